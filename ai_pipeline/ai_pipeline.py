@@ -1,29 +1,39 @@
 import os
-import google.generativeai as genai
+import sys
 from dotenv import load_dotenv
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from ai_pipeline.scheduler import BATCH, LLMError, get_scheduler
 load_dotenv()
 
-key=os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=key)
+MODEL = "gemini-2.0-flash-001"
+_genai = None
+
+def get_genai():
+   # google.generativeai is slow to import, load and configure it on the first model call
+   global _genai
+   if _genai is None:
+       import google.generativeai as genai
+       genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+       _genai = genai
+   return _genai
 
-def rewrite(text):
+def generate(prompt):
+   model = get_genai().GenerativeModel(MODEL)
+   response = model.generate_content(prompt)
+   return response.text.strip()
+
+# both raise LLMError when the model can't be reached, callers must not store the input as output
+def rewrite(text, priority=BATCH):
    prompt = f"Rewrite this to be clearer and more engaging:\n{text}"
-   try:
-       model = genai.GenerativeModel("gemini-2.0-flash-001")
-       response = model.generate_content(prompt)
-       return response.text.strip()
-   except Exception as e:
-       print(f"rewrite failed: {e}")
-       return text
-def review(text):
+   return get_scheduler().call(generate, prompt, priority)
+
+def review(text, priority=BATCH):
    prompt = f"Fix grammar and improve flow:\n{text}"
-   try:
-       model = genai.GenerativeModel("gemini-2.0-flash-001")  
-       response = model.generate_content(prompt)
-       return response.text.strip()
-   except Exception as e:
-       print(f"review failed:{e}")
-       return text
+   return get_scheduler().call(generate, prompt, priority)
 
 def main():
    
@@ -32,10 +42,14 @@ def main():
        return
    with open("content.txt",encoding="utf-8")as  f:
        text = f.read()
-   print("rewriting...")
-   better_text = rewrite(text)
-   print("reviewing...")
-   final_text = review(better_text)
+   try:
+       print("rewriting...")
+       better_text = rewrite(text)
+       print("reviewing...")
+       final_text = review(better_text)
+   except LLMError as e:
+       print(f"model call failed: {e}")
+       return
    
    with open("rewritten.txt","w")as f:
        f.write(better_text)
@@ -44,4 +58,4 @@ def main():
    print("done -check rewritten.txt and reviewed.txt")
 
 if __name__=="__main__":
-   main()
\ No newline at end of file
+   main()
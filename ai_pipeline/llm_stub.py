@@ -0,0 +1,85 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from ai_pipeline.scheduler import BATCH, INTERACTIVE, LLMError, LLMScheduler
+
+
+class StubRateLimitError(Exception):
+    code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("429 Resource exhausted (stub)")
+        self.retry_after = retry_after
+
+
+class StubLLM:
+    # local stand-in for gemini: enforces its own rpm window and answers 429 above it, with a
+    # retry_after hint for when the window frees up (send_retry_after=False leaves callers guessing)
+    def __init__(self, rpm=60, error_rate=0.0, latency=0.0, send_retry_after=True,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.latency = latency
+        self.send_retry_after = send_retry_after
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.stats = {"ok": 0, "429": 0, "500": 0}
+
+    def generate(self, prompt):
+        with self.lock:
+            now = self.clock()
+            while self.calls and now - self.calls[0] >= 60:
+                self.calls.popleft()
+            if len(self.calls) >= self.rpm:
+                self.stats["429"] += 1
+                raise StubRateLimitError(60 - (now - self.calls[0]) if self.send_retry_after else None)
+            self.calls.append(now)
+        if self.latency:
+            self.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.stats["500"] += 1
+            raise RuntimeError("500 internal error (stub)")
+        self.stats["ok"] += 1
+        return prompt.upper()
+
+
+class SimulatedClock:
+    # time only moves when someone sleeps, so minutes of quota behaviour run instantly
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+if __name__ == "__main__":
+    # the scheduler is budgeted above the stub's quota, so it has to learn the real limit from
+    # 429s; 2% of calls fail with a 500
+    clock = SimulatedClock()
+    stub = StubLLM(rpm=20, error_rate=0.02, latency=0.5, clock=clock, sleep=clock.sleep)
+    scheduler = LLMScheduler(rpm=30, tpm=1_000_000, clock=clock, sleep=clock.sleep)
+    done, failed = 0, 0
+    for i in range(120):
+        try:
+            scheduler.call(stub.generate, f"chapter {i}", INTERACTIVE if i % 4 == 0 else BATCH)
+            done += 1
+        except LLMError as e:
+            failed += 1
+            print(f"failed: {e}")
+    print(f"{done} calls ok, {failed} failed in {clock.now / 60:.1f} simulated minutes "
+          f"({done / clock.now * 60:.1f}/min sustained, stub quota {stub.rpm}/min)")
+    print("stub:", stub.stats)
+    print("scheduler:", scheduler.get_stats())
@@ -0,0 +1,234 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+INTERACTIVE = 0
+BATCH = 1
+
+
+class LLMError(Exception):
+    pass
+
+
+class CircuitOpen(LLMError):
+    pass
+
+
+class LLMCallFailed(LLMError):
+    pass
+
+
+def is_rate_limit(error):
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return True
+    text = str(error).lower()
+    return "429" in text or "resource exhausted" in text or "resource_exhausted" in text or "quota" in text
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for english prose, good enough for budgeting
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None, clock=time.monotonic):
+        self.nominal = self.rate = per_minute / 60.0
+        # allow ~10s worth of burst, a full minute of burst trips per-minute quotas
+        self.capacity = capacity or max(1.0, per_minute / 6.0)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        # a request bigger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        # tolerance for float rounding, sleeping exactly `wait` must be enough
+        if self.tokens >= amount - 1e-9:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def throttle(self, factor=0.5, floor=0.1):
+        # the provider pushed back: halve the rate and drop the burst
+        self._refill()
+        self.rate = max(self.nominal * floor, self.rate * factor)
+        self.tokens = min(self.tokens, 0.0)
+
+    def recover(self, step=0.1):
+        if self.rate < self.nominal:
+            self._refill()
+            self.rate = min(self.nominal, self.rate + self.nominal * step)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_after=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        # half open lets a single probe through, everyone else is rejected until it reports back
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at < self.reset_after or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        # the probe got an answer that says nothing about an outage (e.g. a 429)
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = self.clock()
+            self.probing = False
+
+
+class LLMScheduler:
+    def __init__(self, rpm=15, tpm=1_000_000, max_retries=4, base_delay=1.0, max_delay=30.0,
+                 breaker=None, clock=time.monotonic, sleep=time.sleep):
+        self.requests = TokenBucket(rpm, clock=clock)
+        self.tokens = TokenBucket(tpm, clock=clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.sleep = sleep
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.seq = itertools.count()
+        self.stats = {"calls": 0, "succeeded": 0, "retries": 0, "rate_limited": 0,
+            "failed": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls):
+        # NF_LLM_RPM/TPM are the quota of the whole deployment, every process that calls the model
+        # (uvicorn workers, run_pipeline.py) gets an equal share of it
+        processes = max(1, int(os.getenv("NF_LLM_PROCESSES", os.getenv("WEB_CONCURRENCY", "1"))))
+        return cls(rpm=max(1, int(os.getenv("NF_LLM_RPM", "15")) // processes),
+            tpm=max(1, int(os.getenv("NF_LLM_TPM", "1000000")) // processes),
+            max_retries=int(os.getenv("NF_LLM_RETRIES", "4")))
+
+    def _admit(self, priority, tokens):
+        # lowest priority value first, fifo within a class; only the head may take from the buckets
+        ticket = (priority, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+        try:
+            while True:
+                with self.cond:
+                    while self.waiting[0] != ticket:
+                        self.cond.wait()
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        return
+                # the head waits for the refill outside the lock, a higher priority arrival takes over
+                self.sleep(wait)
+        finally:
+            with self.cond:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+
+    def _backoff(self, attempt, error):
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            return float(retry_after) + random.uniform(0, self.base_delay)
+        # full jitter keeps retrying callers from lining up again
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, prompt, priority=BATCH, expected_tokens=None):
+        self.stats["calls"] += 1
+        tokens = estimate_tokens(prompt) + (expected_tokens or estimate_tokens(prompt))
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self.stats["rejected"] += 1
+                raise CircuitOpen(f"llm circuit open after {self.breaker.failures} failures") from last_error
+            self._admit(priority, tokens)
+            try:
+                result = fn(prompt)
+            except Exception as e:
+                last_error = e
+                if is_rate_limit(e):
+                    # quota pushback means the backend is up, slow down instead of counting an outage
+                    self.stats["rate_limited"] += 1
+                    self.breaker.release()
+                    with self.cond:
+                        self.requests.throttle()
+                else:
+                    self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    break
+                self.stats["retries"] += 1
+                delay = self._backoff(attempt, e)
+                print(f"llm call failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                self.sleep(delay)
+                continue
+            self.breaker.record_success()
+            with self.cond:
+                self.requests.recover()
+            self.stats["succeeded"] += 1
+            return result
+        self.stats["failed"] += 1
+        raise LLMCallFailed(f"llm call failed after {self.max_retries + 1} attempts: {last_error}") from last_error
+
+    def get_stats(self):
+        with self.cond:
+            queued = len(self.waiting)
+            rpm = self.requests.rate * 60
+        return {**self.stats,
+            "queued": queued,
+            "rpm": round(rpm, 2),
+            "circuit": self.breaker.state}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler.from_env()
+    return _scheduler
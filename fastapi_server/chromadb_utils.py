@@ -1,27 +1,149 @@
-import chromadb
+import hashlib
+import re
+import threading
 import uuid
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import unquote, urlparse
+
+SHARD_SEP = "__"
+REBUILD_SUFFIX = "_rebuild"
+
+
+def hnsw_settings_from_env():
+    return {"M": int(os.getenv("NF_HNSW_M", "16")),
+        "ef_construction": int(os.getenv("NF_HNSW_EF_CONSTRUCTION", "100")),
+        "ef_search": int(os.getenv("NF_HNSW_EF_SEARCH", "50"))}
+
+
+def book_from_url(url):
+    # https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1 -> The_Gates_of_Morning
+    path = unquote(urlparse(url or "").path)
+    if path.startswith("/wiki/"):
+        path = path[len("/wiki/"):]
+    return path.strip("/").split("/")[0] or None
+
+
+def shard_slug(book):
+    # chroma collection names: 3-63 chars of [a-zA-Z0-9._-], starting and ending alphanumeric
+    slug = re.sub(r"[^a-z0-9]+", "_", book.lower()).strip("_") or "book"
+    if len(slug) > 36:
+        slug = f"{slug[:27]}_{hashlib.sha1(book.encode('utf-8')).hexdigest()[:8]}"
+    return slug
+
 
 class ChromaDBManager:
-    def __init__(self, collection_name="content_versions"):
+    def __init__(self, collection_name="content_versions", hnsw=None):
         try:
+            # chromadb pulls in onnxruntime and friends, only pay for it when a store is opened
+            import chromadb
+            from fastapi_server.embeddings import CachedEmbeddingFunction, EmbeddingMismatch
+
             db_path = os.path.join(os.path.dirname(__file__), "..", "data", "chromadb")
             os.makedirs(db_path, exist_ok=True)
             self.client = chromadb.PersistentClient(path=db_path)
-            
+            self.embedding_function = CachedEmbeddingFunction.from_env()
+            self.base_name = collection_name
+            self.hnsw = {**hnsw_settings_from_env(), **(hnsw or {})}
+            self.shards = {}
+            self.shard_lock = threading.Lock()
+            # held by store_version for each add and by rebuild_shard for the whole copy and swap
+            self.write_locks = {}
+            self.pool = ThreadPoolExecutor(max_workers=int(os.getenv("NF_SHARD_THREADS", "8")),
+                                           thread_name_prefix="shard")
+
+            # unsharded collection: content without a book, and everything stored before sharding
             try:
-                self.collection = self.client.get_collection(collection_name)
+                self.collection = self.client.get_collection(
+                    collection_name, embedding_function=self.embedding_function)
+                self.embedding_function.check_compatible(collection_name, self.collection.metadata)
                 count = self.collection.count()
                 print(f"Connected to existing collection: {collection_name} with {count} documents")
+            except EmbeddingMismatch:
+                raise
             except:
-                self.collection = self.client.create_collection(collection_name)
+                self.collection = self._create(collection_name)
                 print(f"Created new collection: {collection_name}")
-                
+
+            self._recover_rebuilds()
+            for name in self._collection_names():
+                if name.startswith(collection_name + SHARD_SEP) and not name.endswith(REBUILD_SUFFIX):
+                    shard = self.client.get_collection(name, embedding_function=self.embedding_function)
+                    self.embedding_function.check_compatible(name, shard.metadata)
+                    self.shards[name] = shard
+            if self.shards:
+                print(f"Found {len(self.shards)} book shards")
+
         except Exception as e:
             print(f"Failed to initialize ChromaDB: {e}")
             raise
 
+    def _metadata(self, hnsw):
+        return {"hnsw:M": hnsw["M"],
+            "hnsw:construction_ef": hnsw["ef_construction"],
+            "hnsw:search_ef": hnsw["ef_search"],
+            **self.embedding_function.signature()}
+
+    def _create(self, name, hnsw=None, **extra):
+        return self.client.create_collection(
+            name, embedding_function=self.embedding_function,
+            metadata={**self._metadata(hnsw or self.hnsw), **extra})
+
+    def _recover_rebuilds(self):
+        # a rebuild that died between dropping the old shard and renaming the new one leaves the
+        # data only under *_rebuild: finish the rename. a copy that never got swapped in is dropped
+        names = set(self._collection_names())
+        for name in names:
+            if not name.endswith(REBUILD_SUFFIX):
+                continue
+            tmp = self.client.get_collection(name, embedding_function=self.embedding_function)
+            target = (tmp.metadata or {}).get("rebuild_of")
+            if target and target not in names:
+                tmp.modify(name=target)
+                print(f"Recovered interrupted rebuild of {target}")
+            else:
+                self.client.delete_collection(name)
+                print(f"Dropped unfinished rebuild copy {name}")
+
+    def _write_lock(self, name):
+        with self.shard_lock:
+            return self.write_locks.setdefault(name, threading.Lock())
+
+    def _collection_names(self):
+        # chromadb < 0.6 returns Collection objects, newer versions return names
+        return [getattr(c, "name", c) for c in self.client.list_collections()]
+
+    def shard_name(self, book):
+        return f"{self.base_name}{SHARD_SEP}{shard_slug(book)}"
+
+    def collection_for(self, book=None, create=False):
+        if not book:
+            return self.collection
+        name = self.shard_name(book)
+        shard = self.shards.get(name)
+        if shard is None and create:
+            with self.shard_lock:
+                shard = self.shards.get(name)
+                if shard is None:
+                    shard = self.client.get_or_create_collection(
+                        name, embedding_function=self.embedding_function,
+                        metadata=self._metadata(self.hnsw))
+                    self.embedding_function.check_compatible(name, shard.metadata)
+                    self.shards[name] = shard
+                    print(f"Created shard {name} for book {book}")
+        return shard
+
+    def _collections(self, book=None):
+        if book:
+            shard = self.collection_for(book)
+            return [shard] if shard is not None else []
+        return [self.collection] + list(self.shards.values())
+
+    def list_books(self):
+        return {name[len(self.base_name + SHARD_SEP):]: shard.count()
+            for name, shard in list(self.shards.items())}
+
     def store_version(self, content, role, metadata=None):
         try:
             version_id = f"{role}_{uuid.uuid4().hex[:6]}_{datetime.now().strftime('%H%M')}"
@@ -31,76 +153,172 @@ class ChromaDBManager:
                 "version_id": version_id,
                 **(metadata or {})
             }
-            
-            self.collection.add(
-                documents=[content],
-                metadatas=[meta],
-                ids=[version_id]
-            )
+
+            name = self.collection_for(meta.get("book"), create=True).name
+            with self._write_lock(name):
+                # look the collection up again, a rebuild may have swapped it while we waited
+                self.collection_for(meta.get("book")).add(
+                    documents=[content],
+                    metadatas=[meta],
+                    ids=[version_id]
+                )
             print(f"Stored content with ID: {version_id}")
             return version_id
         except Exception as e:
             print(f"Failed to store version: {e}")
             return None
 
-    def search(self, query, limit=5):
+    def warm_up(self):
+        # the model is downloaded and loaded on the first embedding call
+        self.embedding_function.warm_up()
+        print("Embedding model warmed up")
+
+    def get_version(self, version_id, book=None):
         try:
-            # First check if collection has any documents
-            count = self.collection.count()
-            print(f"Collection has {count} documents")
-            
-            if count == 0:
-                print("No documents in collection to search")
+            for res in self.pool.map(lambda c: c.get(ids=[version_id]), self._collections(book)):
+                if res.get("ids"):
+                    return {
+                        "version_id": res["ids"][0],
+                        "content": res["documents"][0],
+                        "metadata": res["metadatas"][0] or {}
+                    }
+            return None
+        except Exception as e:
+            print(f"Failed to get version {version_id}: {e}")
+            return None
+
+    def count(self, book=None):
+        return sum(c.count() for c in self._collections(book))
+
+    def _query_collection(self, collection, embedding, limit):
+        count = collection.count()
+        if count == 0:
+            return []
+        res = collection.query(query_embeddings=[embedding], n_results=min(limit, count))
+        docs = res["documents"][0] if res["documents"] else []
+        metas = res.get("metadatas", [[]])[0]
+        dists = res.get("distances", [[]])[0]
+        return list(zip(docs, metas, dists))
+
+    def search(self, query, limit=5, book=None):
+        try:
+            collections = self._collections(book)
+            print(f"Searching {len(collections)} collections")
+            if not collections:
                 return []
-            
-            res = self.collection.query(query_texts=[query], n_results=min(limit, count))
-            docs = res["documents"][0] if res["documents"] else []
-            metas = res.get("metadatas", [[]])[0]
-            dists = res.get("distances", [[]])[0]
-            
+
+            # embed once and fan the vector out to every shard, then keep the overall top-k
+            embedding = self.embedding_function.embed_one(query)
+            hits = []
+            for shard_hits in self.pool.map(
+                    lambda c: self._query_collection(c, embedding, limit), collections):
+                hits.extend(shard_hits)
+            hits.sort(key=lambda h: h[2])
+
             results = []
-            for i, (doc, meta) in enumerate(zip(docs, metas)):
-                score = 1 - dists[i] if i < len(dists) else 0.5
+            for doc, meta, dist in hits[:limit]:
+                meta = meta or {}
                 result = {
                     "content": doc[:200] + "..." if len(doc) > 200 else doc,
                     "role": meta.get("role", ""),
                     "version_id": meta.get("version_id", ""),
-                    "score": score,
+                    "score": 1 - dist,
                     "timestamp": meta.get("timestamp", ""),
-                    "type": meta.get("type", "")
+                    "type": meta.get("type", ""),
+                    "book": meta.get("book", "")
                 }
                 results.append(result)
-            
+
             print(f"Search for '{query}' returned {len(results)} results")
             return results
-            
+
         except Exception as e:
             print(f"Search failed: {e}")
             return []
-    
+
+    def get_documents(self, book=None, ids=None, where=None, include=None, limit=None, offset=None):
+        collection = self.collection_for(book)
+        if collection is None:
+            return {"ids": [], "documents": [], "metadatas": []}
+        res = collection.get(ids=ids, where=where, include=include or ["documents", "metadatas"],
+                             limit=limit, offset=offset)
+        return {"ids": res.get("ids") or [],
+            "documents": res.get("documents") or [],
+            "metadatas": res.get("metadatas") or []}
+
+    def raw_query(self, query, limit=5, book=None):
+        collection = self.collection_for(book)
+        if collection is None:
+            return {"documents": [], "distances": [], "metadatas": [], "ids": []}
+        result = collection.query(query_embeddings=[self.embedding_function.embed_one(query)], n_results=limit)
+        return {"documents": result.get("documents", []),
+            "distances": result.get("distances", []),
+            "metadatas": result.get("metadatas", []),
+            "ids": result.get("ids", [])}
+
     def get_all_documents(self):
         try:
-            count = self.collection.count()
-            if count == 0:
-                return {"count": 0, "documents": [], "metadatas": [], "ids": []}
-            res = self.collection.get()
-            return {
-                "count": count,
-                "documents": res.get("documents", []),
-                "metadatas": res.get("metadatas", []),
-                "ids": res.get("ids", [])
-            }
+            out = {"count": 0, "documents": [], "metadatas": [], "ids": []}
+            for collection in self._collections():
+                if collection.count() == 0:
+                    continue
+                res = collection.get()
+                out["documents"].extend(res.get("documents", []))
+                out["metadatas"].extend(res.get("metadatas", []))
+                out["ids"].extend(res.get("ids", []))
+            out["count"] = len(out["ids"])
+            return out
         except Exception as e:
             print(f"Failed to get all documents: {e}")
             return {"count": 0, "documents": [], "metadatas": [], "ids": []}
-    
+
+    def rebuild_shard(self, book, batch_size=500, **hnsw):
+        # copy into a fresh index with the new settings page by page, reusing the stored embeddings.
+        # writes to the book wait until the swap, anything stored mid-copy would be lost with the old index
+        old = self.collection_for(book)
+        if old is None:
+            return False
+        settings = {**self.hnsw, **hnsw}
+        name = old.name
+        tmp_name = f"{name[:55]}{REBUILD_SUFFIX}"
+        with self._write_lock(name):
+            try:
+                old = self.collection_for(book)
+                if tmp_name in self._collection_names():
+                    self.client.delete_collection(tmp_name)
+                new = self._create(tmp_name, settings, rebuild_of=name)
+                offset = 0
+                while True:
+                    page = old.get(limit=batch_size, offset=offset,
+                                   include=["documents", "metadatas", "embeddings"])
+                    if not len(page["ids"]):
+                        break
+                    new.add(ids=page["ids"], documents=page["documents"],
+                            metadatas=page["metadatas"], embeddings=page["embeddings"])
+                    offset += len(page["ids"])
+                with self.shard_lock:
+                    # a crash between these two calls is finished by _recover_rebuilds on the next start
+                    self.client.delete_collection(name)
+                    new.modify(name=name)
+                    self.shards[name] = self.client.get_collection(
+                        name, embedding_function=self.embedding_function)
+                print(f"Rebuilt shard {name} with {offset} documents, {settings}")
+                return True
+            except Exception as e:
+                print(f"Failed to rebuild shard {name}: {e}")
+                return False
+
     def clear_collection(self):
         try:
             collection_name =self.collection.name
             self.client.delete_collection(collection_name)
-            self.collection = self.client.create_collection(collection_name)
+            self.collection = self._create(collection_name)
+            with self.shard_lock:
+                for name in list(self.shards):
+                    self.client.delete_collection(name)
+                self.shards.clear()
             print(f"Cleared collection:{collection_name}")
             return True
         except Exception as e:
             print(f"Failed to clear collection:{e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_CACHE = os.path.join(os.path.dirname(__file__), "..", "data", "embedding_cache.sqlite3")
+KNOWN_DIMENSIONS = {DEFAULT_MODEL: 384}
+
+
+class EmbeddingMismatch(ValueError):
+    pass
+
+
+def onnx_session(ef, threads):
+    # chromadb opens its session with onnxruntime's default of one thread per core, which
+    # oversubscribes once several pool workers embed at the same time
+    import onnxruntime as ort
+
+    ef._download_model_if_not_exists()
+    options = ort.SessionOptions()
+    options.log_severity_level = 3
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(os.path.join(ef.DOWNLOAD_PATH, ef.EXTRACTED_FOLDER_NAME, "model.onnx"),
+                                providers=["CPUExecutionProvider"], sess_options=options)
+
+
+class EmbeddingCache:
+    # vectors are stored as float32 blobs keyed by sha256(model + text)
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+            self.conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            # stay well below sqlite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+        return found
+
+    def put_many(self, items):
+        rows = [(key, array("f", vec).tobytes()) for key, vec in items]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self.conn.commit()
+
+
+class CachedEmbeddingFunction:
+    def __init__(self, backend="onnx", model=DEFAULT_MODEL, batch_size=32, threads=2,
+                 quantized=False, cache_path=DEFAULT_CACHE, dimension=None):
+        if backend == "onnx" and (quantized or model != DEFAULT_MODEL):
+            # chromadb only ships the fp32 MiniLM export
+            print(f"onnx backend only serves {DEFAULT_MODEL} in fp32, "
+                  "use NF_EMBED_BACKEND=sentence-transformers for other or quantized models")
+            model, quantized = DEFAULT_MODEL, False
+        self.backend = backend
+        self.model_name = model
+        self.batch_size = max(1, batch_size)
+        self.threads = max(1, threads)
+        # split the cores between pool workers instead of every batch grabbing all of them
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.threads)
+        self.quantized = quantized
+        # known up front for the default model or NF_EMBED_DIM, otherwise learned from the first batch
+        self._dimension = dimension or KNOWN_DIMENSIONS.get(model)
+        # (collection, dims) the opened collections were built with, checked against real vectors
+        self.expected = None
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed")
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "embedded": 0, "batches": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(backend=os.getenv("NF_EMBED_BACKEND", "onnx"),
+            model=os.getenv("NF_EMBED_MODEL", DEFAULT_MODEL),
+            batch_size=int(os.getenv("NF_EMBED_BATCH", "32")),
+            threads=int(os.getenv("NF_EMBED_THREADS", "2")),
+            quantized=os.getenv("NF_EMBED_QUANTIZED", "0") == "1",
+            cache_path=os.getenv("NF_EMBED_CACHE", DEFAULT_CACHE),
+            dimension=int(os.getenv("NF_EMBED_DIM", "0")) or None)
+
+    def _load(self):
+        if self._model is not None:
+            return self._model
+        with self._model_lock:
+            if self._model is None:
+                if self.backend == "sentence-transformers":
+                    import torch
+                    from sentence_transformers import SentenceTransformer
+
+                    torch.set_num_threads(self.threads_per_worker)
+                    model = SentenceTransformer(self.model_name, device="cpu")
+                    if self.quantized:
+                        model = torch.quantization.quantize_dynamic(
+                            model, {torch.nn.Linear}, dtype=torch.qint8)
+                    self._model = lambda texts: model.encode(
+                        texts, batch_size=self.batch_size, convert_to_numpy=True)
+                elif self.backend == "onnx":
+                    from chromadb.utils import embedding_functions
+
+                    model = embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+                    try:
+                        # `model` is a cached_property, seed it with the thread-limited session
+                        model.__dict__["model"] = onnx_session(model, self.threads_per_worker)
+                    except Exception as e:
+                        print(f"Could not limit onnx threads, using chromadb's session: {e}")
+                    self._model = model
+                else:
+                    raise ValueError(f"unknown embedding backend: {self.backend}")
+                print(f"Loaded embedding model {self.model_name} ({self.backend})")
+        return self._model
+
+    def warm_up(self):
+        self._load()
+
+    def signature(self):
+        # stored in collection metadata so a collection is never mixed with another model's vectors
+        signature = {"embedding:model": self.model_name}
+        if self._dimension:
+            signature["embedding:dim"] = self._dimension
+        return signature
+
+    def _mismatch(self, name, model, dim, got=None):
+        return EmbeddingMismatch(
+            f"collection {name} holds {model} vectors ({dim or '?'} dims), configured model is "
+            f"{self.model_name} ({got or self._dimension or '?'} dims); "
+            "set NF_EMBED_MODEL back or re-embed into a new store")
+
+    def check_compatible(self, name, metadata):
+        # only compares what is known without loading the model, the dimension is checked
+        # again on the first vectors we compute
+        metadata = metadata or {}
+        # collections from before the model was recorded were embedded with the default MiniLM
+        model = metadata.get("embedding:model", DEFAULT_MODEL)
+        dim = metadata.get("embedding:dim", KNOWN_DIMENSIONS.get(model))
+        if model != self.model_name or (dim and self._dimension and dim != self._dimension):
+            raise self._mismatch(name, model, dim)
+        if dim:
+            if self.expected and self.expected[1] != dim:
+                raise self._mismatch(name, model, dim, self.expected[1])
+            self.expected = (name, dim)
+
+    def embed_one(self, text):
+        # search queries are one-off, caching them would only grow the cache
+        return self._embed_batch([text])[0]
+
+    def _key(self, text):
+        salt = f"{self.backend}:{self.model_name}:{int(self.quantized)}"
+        return hashlib.sha256(f"{salt}\0{text}".encode("utf-8")).hexdigest()
+
+    def _embed_batch(self, texts):
+        vectors = [[float(x) for x in vec] for vec in self._load()(texts)]
+        if vectors:
+            got = len(vectors[0])
+            if self.expected and got != self.expected[1]:
+                raise self._mismatch(self.expected[0], self.model_name, self.expected[1], got)
+            self._dimension = got
+        return vectors
+
+    def __call__(self, input):
+        texts = list(input)
+        keys = [self._key(t) for t in texts]
+        vectors = self.cache.get_many(list(set(keys))) if self.cache else {}
+        self.stats["cache_hits"] += sum(1 for k in keys if k in vectors)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            todo = list(missing.items())
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            results = self.pool.map(lambda batch: self._embed_batch([t for _, t in batch]), batches)
+            fresh = []
+            for batch, embedded in zip(batches, results):
+                fresh.extend((key, vec) for (key, _), vec in zip(batch, embedded))
+            vectors.update(fresh)
+            if self.cache:
+                self.cache.put_many(fresh)
+            self.stats["embedded"] += len(fresh)
+            self.stats["batches"] += len(batches)
+        return [vectors[k] for k in keys]
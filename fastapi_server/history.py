@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows: the log is only safe with a single worker there
+    fcntl = None
+
+HISTORY_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "history")
+WINDOWS = {"5m": 300, "1h": 3600, "24h": 86400}
+
+
+class HistoryStore:
+    # newest `maxlen` records in memory, every record in an append-only jsonl log shared by all
+    # workers. each process tails the log, so the ring and the per-minute buckets behind /stats
+    # are the same in every worker; /stats never walks the records
+    def __init__(self, name, root=HISTORY_DIR, maxlen=1000, key_field=None, value_field=None,
+                 category_field=None, retention_seconds=7 * 86400, max_log_records=100_000):
+        self.name = name
+        self.maxlen = maxlen
+        self.key_field = key_field
+        self.value_field = value_field
+        self.category_field = category_field
+        self.retention = retention_seconds
+        self.max_log_records = max_log_records
+        self.lock = threading.Lock()
+        self.compactor = None
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{name}.jsonl")
+        # appends hold this shared, the compaction swap holds it exclusive
+        self.lock_file = open(self.path + ".lock", "a")
+        self.compact_lock_path = self.path + ".compact.lock"
+        self.log = None
+        self.inode = None
+        self.offset = 0
+        self._reset()
+        with self.lock, self._file_lock(shared=True):
+            self._sync()
+        print(f"Loaded {len(self.recent)} recent {self.name} records")
+
+    @contextmanager
+    def _file_lock(self, shared):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.recent = deque(maxlen=self.maxlen)
+        self.index = {}
+        self.buckets = OrderedDict()
+        self.total = 0
+        self.offset = 0
+
+    def _sync(self):
+        # reopen after a compaction swapped the file, then apply whatever any worker appended
+        if not os.path.exists(self.path):
+            open(self.path, "a").close()
+        stat = os.stat(self.path)
+        if self.log is None or stat.st_ino != self.inode:
+            if self.log is not None:
+                self.log.close()
+            self._reset()
+            self.log = open(self.path, "a", encoding="utf-8")
+            self.inode = os.fstat(self.log.fileno()).st_ino
+            stat = os.stat(self.path)
+        if stat.st_size <= self.offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            chunk = f.read()
+        # another worker may be mid-line, leave a partial tail for the next sync
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            self._apply(line)
+        self.offset += end
+
+    def _apply(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        key = record.get(self.key_field) if self.key_field else None
+        if "ts" not in record or (self.key_field and key is None):
+            return
+        if key is not None and key in self.index:
+            # keyed records are logged again on every update, merge into the one in memory
+            self.index[key].update(self._changes(record))
+            return
+        if record.get("_update"):
+            # a change to a record that has left the ring, it was counted when it was appended
+            return
+        self._count(record)
+        self._remember(record)
+
+    @staticmethod
+    def _changes(record):
+        # the first ts of a record is when it happened, later updates keep it
+        return {k: v for k, v in record.items() if k not in ("ts", "_update")}
+
+    def _remember(self, record):
+        if len(self.recent) == self.maxlen and self.key_field:
+            old = self.recent[0]
+            if self.index.get(old[self.key_field]) is old:
+                del self.index[old[self.key_field]]
+        self.recent.append(record)
+        if self.key_field:
+            self.index[record[self.key_field]] = record
+
+    def _count(self, record):
+        minute = int(record["ts"] // 60)
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            bucket = self.buckets[minute] = {"count": 0, "sum": 0.0, "categories": {}}
+        bucket["count"] += 1
+        if self.value_field and isinstance(record.get(self.value_field), (int, float)):
+            bucket["sum"] += record[self.value_field]
+        if self.category_field and record.get(self.category_field) is not None:
+            cat = str(record[self.category_field])
+            bucket["categories"][cat] = bucket["categories"].get(cat, 0) + 1
+        self.total += 1
+        horizon = int(time.time() // 60) - max(WINDOWS.values()) // 60
+        while self.buckets and next(iter(self.buckets)) < horizon:
+            self.buckets.popitem(last=False)
+
+    def _write(self, record):
+        self._sync()
+        self.log.write(json.dumps(record, default=str) + "\n")
+        self.log.flush()
+        self._sync()
+
+    def append(self, record):
+        record = {**record, "ts": time.time()}
+        record.setdefault("time", datetime.now().isoformat())
+        with self.lock, self._file_lock(shared=True):
+            self._write(record)
+            if self.key_field:
+                return self.index.get(record[self.key_field], record)
+        return record
+
+    def update(self, key, **fields):
+        with self.lock, self._file_lock(shared=True):
+            self._sync()
+            record = self.index.get(key)
+            if record is None:
+                # evicted from memory, still log the change; compaction merges it by key.
+                # the ts only decides retention, the record keeps the one it was appended with
+                record = {self.key_field: key, "ts": time.time(), "_update": True}
+            record.update(fields)
+            self._write(record)
+            return self.index.get(key, record)
+
+    def get(self, key):
+        with self.lock, self._file_lock(shared=True):
+            self._sync()
+            return self.index.get(key)
+
+    def latest(self, n=5):
+        with self.lock, self._file_lock(shared=True):
+            self._sync()
+            return list(self.recent)[-n:]
+
+    def stats(self):
+        now_minute = int(time.time() // 60)
+        with self.lock, self._file_lock(shared=True):
+            self._sync()
+            buckets = list(self.buckets.items())
+            total = self.total
+            in_memory = len(self.recent)
+        out = {"total": total, "in_memory": in_memory, "windows": {}}
+        for label, seconds in WINDOWS.items():
+            count, value, cats = 0, 0.0, {}
+            for minute, bucket in buckets:
+                if minute > now_minute - seconds // 60:
+                    count += bucket["count"]
+                    value += bucket["sum"]
+                    for cat, n in bucket["categories"].items():
+                        cats[cat] = cats.get(cat, 0) + n
+            window = {"count": count}
+            if self.value_field:
+                window["avg_" + self.value_field] = value / count if count else 0
+            if self.category_field:
+                window[self.category_field] = cats
+            out["windows"][label] = window
+        return out
+
+    @contextmanager
+    def _compaction_lock(self):
+        # one compactor across all workers, the others skip their turn
+        with open(self.compact_lock_path, "a") as f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+
+    def compact(self):
+        with self._compaction_lock() as acquired:
+            if not acquired:
+                print(f"{self.name} history is being compacted by another worker")
+                return False
+            self._compact()
+            return True
+
+    def _compact(self):
+        # rewrite everything logged so far without blocking appends, then splice in what was
+        # appended meanwhile and swap files; every worker reopens the new file on its next sync
+        with self.lock, self._file_lock(shared=False):
+            self._sync()
+            end = os.path.getsize(self.path)
+        cutoff = time.time() - self.retention
+        kept = OrderedDict()
+        with open(self.path, "rb") as f:
+            for n, line in enumerate(f.read(end).splitlines()):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("ts", 0) < cutoff:
+                    continue
+                key = record.get(self.key_field) if self.key_field else n
+                if key in kept:
+                    # merged in place, the record stays where it was first appended
+                    kept[key].update(self._changes(record))
+                else:
+                    kept[key] = record
+                if len(kept) > self.max_log_records:
+                    kept.popitem(last=False)
+        tmp = self.path + ".compact"
+        with open(tmp, "w", encoding="utf-8") as out:
+            for record in kept.values():
+                out.write(json.dumps(record, default=str) + "\n")
+        with self.lock, self._file_lock(shared=False):
+            with open(self.path, "rb") as f, open(tmp, "ab") as out:
+                f.seek(end)
+                out.write(f.read())
+            os.replace(tmp, self.path)
+            self._sync()
+        print(f"Compacted {self.name} history to {len(kept)} records")
+
+    def start_compaction(self, interval=3600):
+        if self.compactor is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"{self.name} compaction failed: {e}")
+
+        self.compactor = threading.Thread(target=loop, name=f"{self.name}-compactor", daemon=True)
+        self.compactor.start()
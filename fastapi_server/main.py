@@ -1,22 +1,30 @@
 # main.py - CORRECTED VERSION with working search
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import asyncio
+import json
 import os
 import sys
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 try:
-    from fastapi_server.chromadb_utils import ChromaDBManager
-    print("Imported ChromaDBManager")
+    from fastapi_server.chromadb_utils import book_from_url
+    from fastapi_server.storage_client import connect_store, connect_review_queue
+    print("Imported storage")
 except ImportError as e:
     print(f" Import error: {e}")
+from hitl.review_queue import ReviewError, LeaseError
+from ai_pipeline.scheduler import BATCH, INTERACTIVE, LLMError, get_scheduler
+from fastapi_server.history import HistoryStore
 
 app = FastAPI(title="Gates of Morning API")
 
@@ -27,19 +35,97 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],)
 db_manager =None
+review_queue = None
+# bounded in memory, full history in data/history/*.jsonl shared by all workers, compacted in the background
+HISTORY_SIZE = int(os.getenv("NF_HISTORY_SIZE", "1000"))
+search_history = HistoryStore("searches", maxlen=HISTORY_SIZE, value_field="score", category_field="strategy")
+workflow_history = HistoryStore("workflows", maxlen=HISTORY_SIZE, key_field="workflow_id")
+db_lock = threading.Lock()
+# NF_WARMUP=1 loads the embedding model and browser in the background after startup,
+# /health/ready only reports ready once that is done
+WARMUP = os.getenv("NF_WARMUP", "0") == "1"
+warmup_state = {"enabled": WARMUP, "database": False, "embeddings": False, "browser": False, "error": None}
+# the loop only keeps weak references to tasks, hold on to the warm-up until it finishes
+warmup_task = None
+# model calls wait in the scheduler for quota and backoff (up to a minute), give them their own
+# threads so they never hold up the default executor that storage calls and /health/ready use
+llm_pool = ThreadPoolExecutor(max_workers=int(os.getenv("NF_LLM_THREADS", "8")), thread_name_prefix="llm")
 
-@app.on_event("startup")
-async def startup_event():
-    global db_manager
+async def llm_call(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(llm_pool, fn, *args)
+
+def get_db():
+    global db_manager, review_queue
+    if db_manager is None:
+        with db_lock:
+            if db_manager is None:
+                # local chromadb, or the shared storage server when NF_STORAGE_URL is set
+                db = connect_store(collection_name="content_versions")
+                review_queue = connect_review_queue(db)
+                db_manager = db
+                warmup_state["database"] = True
+                print(" Database manager initialized")
+    return db_manager
+
+async def require_db():
     try:
-        db_manager = ChromaDBManager(collection_name="content_versions")
-        print(" Database manager initialized")
+        return await asyncio.to_thread(get_db)
     except Exception as e:
         print(f"Database initialization failed: {e}")
+        raise HTTPException(status_code=503, detail=f"Database not available: {e}")
+
+async def warm_up():
+    try:
+        db = await asyncio.to_thread(get_db)
+        await asyncio.to_thread(db.warm_up)
+        warmup_state["embeddings"] = True
+        from scraping.scrape_chapter import get_browser
+        await get_browser()
+        warmup_state["browser"] = True
+        print(" Warm-up finished")
+    except Exception as e:
+        warmup_state["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    global warmup_task
+    interval = int(os.getenv("NF_HISTORY_COMPACT_SECONDS", "3600"))
+    search_history.start_compaction(interval)
+    workflow_history.start_compaction(interval)
+    if WARMUP:
+        warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # /workflow/run launches the browser lazily too, close_browser is a no-op when none is running
+    from scraping.scrape_chapter import close_browser
+    await close_browser()
+    llm_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    if WARMUP:
+        ready = warmup_state["embeddings"] and warmup_state["browser"]
+    else:
+        try:
+            await asyncio.to_thread(get_db)
+        except Exception as e:
+            warmup_state["error"] = str(e)
+        ready = db_manager is not None
+    body = {"status": "ready" if ready else "starting", **warmup_state}
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
 
 class SearchRequest(BaseModel):
     query: str
     limit: int = 5
+    book: Optional[str] = None
 
 class SearchResponse(BaseModel):
     query: str
@@ -48,15 +134,16 @@ class SearchResponse(BaseModel):
 
 @app.post("/search/smart", response_model=SearchResponse)
 async def smart_search(request: SearchRequest):
-    if not db_manager:
-        raise HTTPException(status_code=500, detail="Database not initialized")
+    db_manager = await require_db()
     
     print(f"=== Search Request ===")
     print(f"Query:'{request.query}'")
     print(f"Limit:{request.limit}")
+    print(f"Book:{request.book or 'all'}")
     
     try:
-        doc_count = db_manager.collection.count()
+        # the store is either local chromadb or a blocking http client, keep both off the loop
+        doc_count = await asyncio.to_thread(db_manager.count, request.book)
         print(f"Collection has {doc_count} documents")
         
         if doc_count == 0:
@@ -68,15 +155,20 @@ async def smart_search(request: SearchRequest):
                     "strategy":"none",
                     "error":"No documents in collection",
                     "database_count":doc_count})
-        search_results = db_manager.search(request.query,request.limit)
+        search_results = await asyncio.to_thread(db_manager.search, request.query, request.limit, request.book)
         print(f"Search returned {len(search_results)} results")
+        strategy = "book_search" if request.book else "sharded_search"
+        search_history.append({"query": request.query,
+            "strategy": strategy,
+            "score": sum(r.get("score", 0) for r in search_results) / len(search_results) if search_results else 0,
+            "results_count": len(search_results)})
         for i, result in enumerate(search_results):
             print(f"Result {i+1}: Role={result.get('role')}, Score={result.get('score', 0):.2f}")
             print(f"  Content preview: {result.get('content','')[:100]}...")
         return SearchResponse(
             query=request.query,
             results=search_results,
-            search_info={ "strategy": "direct_search",
+            search_info={ "strategy": strategy,
                 "results_count": len(search_results),
                 "database_count": doc_count,
                 "status": "success" } )
@@ -91,15 +183,14 @@ async def smart_search(request: SearchRequest):
 
 @app.get("/debug/database")
 async def debug_database():
-    if not db_manager:
-        return {"error": "Database not initialized"}
+    db_manager = await require_db()
     try:
-        count = db_manager.collection.count()
+        result = await asyncio.to_thread(db_manager.get_all_documents)
+        count = result["count"]
         if count == 0:
             return {
                 "count": 0,
                 "message": "No documents in collection"}
-        result = db_manager.collection.get()
         documents_info = []
         for i, (doc, doc_id, metadata) in enumerate(zip(
             result["documents"], 
@@ -113,6 +204,7 @@ async def debug_database():
                 "content_preview": doc[:200] + "..." if len(doc) > 200 else doc})
         
         return {"count": count,
+            "books": await asyncio.to_thread(db_manager.list_books),
             "documents": documents_info}
         
     except Exception as e:
@@ -121,8 +213,7 @@ async def debug_database():
 
 @app.post("/debug/test-search")
 async def test_search():
-    if not db_manager:
-        return {"error": "Database not initialized"}
+    db_manager = await require_db()
     
     test_queries = ["chapter",
         "morning",
@@ -134,7 +225,7 @@ async def test_search():
     
     for query in test_queries:
         try:
-            search_results = db_manager.search(query, limit=2)
+            search_results = await asyncio.to_thread(db_manager.search, query, 2)
             results[query] = {
                 "count": len(search_results),
                 "results": [
@@ -151,31 +242,21 @@ async def test_search():
 
 @app.post("/debug/clear")
 async def clear_database():
-    if not db_manager:
-        return {"error": "Database not initialized"}
+    db_manager = await require_db()
     
     try:
-        db_manager.clear_collection()
+        await asyncio.to_thread(db_manager.clear_collection)
         return {"status": "Database cleared"}
     except Exception as e:
         return {"error": str(e)}
 
 @app.get("/debug/raw-search/{query}")
-async def raw_search(query: str):
-    if not db_manager:
-        return {"error": "Database not initialized"}
+async def raw_search(query: str, book: Optional[str] = None):
+    db_manager = await require_db()
     
     try:
-        result = db_manager.collection.query(
-            query_texts=[query],
-            n_results=5)
-        
         return {"query": query,
-            "raw_result": {
-                "documents": result.get("documents", []),
-                "distances": result.get("distances", []),
-                "metadatas": result.get("metadatas", []),
-                "ids": result.get("ids", [])}}
+            "raw_result": await asyncio.to_thread(db_manager.raw_query, query, 5, book)}
     except Exception as e:
         return {"error": str(e)}
 
@@ -199,76 +280,258 @@ class SmartSearch:
         return self.db.search(query, limit)
 
 class WorkflowRunner:
-    def __init__(self,db_manager,searcher):
+    def __init__(self,db_manager,searcher,priority=BATCH,review_queue=None):
         self.db =db_manager
         self.searcher = searcher
+        self.priority = priority
+        self.review_queue = review_queue
     
-    async def run_full_pipeline(self,url):
+    async def run_full_pipeline(self,url,screenshot=True):
         workflow_id =uuid.uuid4().hex[:6]
+        step = "scrape"
+        workflow_history.append({"workflow_id": workflow_id,
+            "status": "running",
+            "url": url,
+            "start": datetime.now().isoformat()})
         
         try:
             from scraping.scrape_chapter import scrape_chapter
+            from scraping.normalize import normalize_chapter
             from ai_pipeline.ai_pipeline import rewrite, review
 
             data_dir = os.path.join(project_root, "data")
             os.makedirs(data_dir,exist_ok=True)
-            screenshot_path = os.path.join(data_dir,"screenshot.png")
             scraped_path = os.path.join(data_dir,"scraped.txt")
             rewritten_path = os.path.join(data_dir,"rewritten.txt")
             reviewed_path = os.path.join(data_dir,"reviewed.txt")
             
+            chapter_meta = {"chapter": url}
+            book = book_from_url(url)
+            if book:
+                chapter_meta["book"] = book
+
             print("Step 1: Scraping...")
-            await scrape_chapter(url, screenshot_path, scraped_path)
+            # returns once the text is saved, the page capture keeps running while the llm works
+            screenshot_job = await scrape_chapter(url, scraped_path, screenshot=screenshot)
             with open(scraped_path, 'r', encoding='utf-8') as f:
-                scraped_content = f.read()
-            scraper_id = self.db.store_version(
+                raw_content = f.read()
+            # drop wiki navigation and footnote markers before anything is embedded or prompted
+            normalized = normalize_chapter(raw_content)
+            scraped_content = normalized["text"]
+            scraper_id = await asyncio.to_thread(
+                self.db.store_version,
                 scraped_content, 
                 "scraper", 
-                {"url": url})
+                {"url": url,
+                 "raw_size": len(raw_content),
+                 "token_estimate": normalized["token_estimate"],
+                 "footnotes": json.dumps(normalized["footnotes"]),
+                 **chapter_meta})
             print("Step 2: Rewriting...")
-            rewritten_content = rewrite(scraped_content)
+            step = "rewrite"
+            rewritten_content = await llm_call(rewrite, scraped_content, self.priority)
             with open(rewritten_path,'w',encoding='utf-8') as f:
                 f.write(rewritten_content)
-            rewriter_id = self.db.store_version(
+            rewriter_id = await asyncio.to_thread(
+                self.db.store_version,
                 rewritten_content,
                 "ai_writer",
-                {"source":scraper_id})
+                {"source":scraper_id, **chapter_meta})
             
             print("Step 3: Reviewing...")
-            reviewed_content = review(rewritten_content)
+            step = "review"
+            reviewed_content = await llm_call(review, rewritten_content, self.priority)
             with open(reviewed_path, 'w', encoding='utf-8') as f:
                 f.write(reviewed_content)
-            reviewer_id = self.db.store_version(
+            reviewer_id = await asyncio.to_thread(
+                self.db.store_version,
                 reviewed_content,
                 "ai_reviewer", 
-                {"source": rewriter_id})
+                {"source": rewriter_id, **chapter_meta})
             
+            screenshot_info = None
+            if screenshot_job is not None:
+                try:
+                    screenshot_info = await screenshot_job
+                except Exception as e:
+                    # the chapter is already stored, a lost screenshot shouldn't fail the run
+                    print(f"Screenshot failed: {e}")
+                    screenshot_info = {"error": str(e)}
+
+            review_task = None
+            if self.review_queue is not None:
+                review_task = await asyncio.to_thread(self.review_queue.enqueue, reviewer_id, chapter=url)
+
+            workflow_history.update(workflow_id,
+                status="completed",
+                end=datetime.now().isoformat(),
+                document_ids=[scraper_id, rewriter_id, reviewer_id])
             return {"workflow_id": workflow_id,
                 "status": "success",
-                "original_size": len(scraped_content),
+                "original_size": len(raw_content),
+                "normalized_size": len(scraped_content),
+                "token_estimate": normalized["token_estimate"],
                 "rewritten_size": len(rewritten_content),
                 "reviewed_size": len(reviewed_content),
-                "files_created": [screenshot_path, scraped_path, rewritten_path, reviewed_path],
+                "files_created": [scraped_path, rewritten_path, reviewed_path],
+                "screenshot": screenshot_info,
                 "document_ids": [scraper_id, rewriter_id, reviewer_id],
+                "review_task": review_task,
                 "next": "ready for human editing"}
             
+        except LLMError as e:
+            # nothing is stored for a failed model step, the chapter can be rerun later
+            print(f"Workflow {step} step failed: {e}")
+            workflow_history.update(workflow_id, status="error", failed_step=step,
+                error=str(e), end=datetime.now().isoformat())
+            return {"workflow_id": workflow_id,
+                "status": "error",
+                "failed_step": step,
+                "error": str(e),
+                "llm": get_scheduler().get_stats()}
         except Exception as e:
             print(f"Workflow error: {e}")
+            workflow_history.update(workflow_id, status="error", failed_step=step,
+                error=str(e), end=datetime.now().isoformat())
             return {"workflow_id": workflow_id,
                 "status": "error",
+                "failed_step": step,
                 "error": str(e)}
 
+@app.get("/workflow/{workflow_id}")
+async def get_workflow(workflow_id: str):
+    workflow = workflow_history.get(workflow_id)
+    if workflow is None:
+        raise HTTPException(status_code=404, detail=f"Workflow not in recent history: {workflow_id}")
+    return workflow
+
+@app.get("/stats")
+async def get_stats():
+    return {"searches": search_history.stats(),
+        "recent_searches": search_history.latest(5),
+        "workflows": workflow_history.stats(),
+        "recent_workflows": workflow_history.latest(5)}
+
+@app.get("/llm/stats")
+async def llm_stats():
+    return get_scheduler().get_stats()
+
+@app.get("/books")
+async def list_books():
+    db_manager = await require_db()
+    return {"books": await asyncio.to_thread(db_manager.list_books),
+        "hnsw": db_manager.hnsw}
+
+class RebuildRequest(BaseModel):
+    M: Optional[int] = None
+    ef_construction: Optional[int] = None
+    ef_search: Optional[int] = None
+
+@app.post("/books/{book}/rebuild")
+async def rebuild_book_index(book: str, request: RebuildRequest):
+    db_manager = await require_db()
+    settings = {k: v for k, v in request.dict().items() if v is not None}
+    ok = await asyncio.to_thread(db_manager.rebuild_shard, book, **settings)
+    if not ok:
+        raise HTTPException(status_code=404, detail=f"Could not rebuild shard for {book}")
+    return {"book": book, "status": "rebuilt", "hnsw": {**db_manager.hnsw, **settings}}
+
+@app.post("/books/{book}/publish")
+async def publish(book: str):
+    from publishing.publish_book import publish_book
+
+    db_manager = await require_db()
+    try:
+        return await asyncio.to_thread(publish_book, db_manager, book)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No content stored for {book}")
+
 @app.post("/workflow/run")
-async def run_workflow():
-    if not db_manager:
-        raise HTTPException(status_code=500, detail="Database not initialized")
+async def run_workflow(screenshot: bool = True):
+    db_manager = await require_db()
     searcher = SmartSearch(db_manager)
-    runner = WorkflowRunner(db_manager, searcher)
+    runner = WorkflowRunner(db_manager, searcher, priority=INTERACTIVE, review_queue=review_queue)
     url = "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
-    result = await runner.run_full_pipeline(url)
+    result = await runner.run_full_pipeline(url, screenshot)
     
     return result
 
+class EnqueueReviewRequest(BaseModel):
+    version_id: str
+    chapter: Optional[str] = None
+
+class ClaimRequest(BaseModel):
+    reviewer: str
+    stage: Optional[str] = None
+
+class LeaseRequest(BaseModel):
+    lease_token: str
+
+class DiffRequest(BaseModel):
+    content: str
+
+class SubmitReviewRequest(BaseModel):
+    lease_token: str
+    content: Optional[str] = None
+    why: str = ""
+    rating: Optional[int] = None
+
+async def get_review_queue():
+    await require_db()
+    return review_queue
+
+async def review_call(fn, *args, **kwargs):
+    # queue calls read and store versions (and embed them), keep that off the event loop
+    try:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Not found: {e}")
+    except LeaseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ReviewError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/review/enqueue")
+async def enqueue_review(request: EnqueueReviewRequest):
+    queue = await get_review_queue()
+    return await review_call(queue.enqueue, request.version_id, request.chapter)
+
+@app.post("/review/claim")
+async def claim_review(request: ClaimRequest):
+    queue = await get_review_queue()
+    task = await review_call(queue.claim, request.reviewer, request.stage)
+    if task is None:
+        raise HTTPException(status_code=404, detail="No review tasks available")
+    return task
+
+@app.post("/review/{task_id}/renew")
+async def renew_review(task_id: str, request: LeaseRequest):
+    queue = await get_review_queue()
+    return await review_call(queue.renew, task_id, request.lease_token)
+
+@app.post("/review/{task_id}/release")
+async def release_review(task_id: str, request: LeaseRequest):
+    queue = await get_review_queue()
+    return await review_call(queue.release, task_id, request.lease_token)
+
+@app.post("/review/{task_id}/diff")
+async def diff_review(task_id: str, request: DiffRequest):
+    queue = await get_review_queue()
+    diff = await review_call(queue.diff, task_id, request.content)
+    return {"task_id": task_id, "diff": diff, "changed": bool(diff)}
+
+@app.post("/review/{task_id}/submit")
+async def submit_review(task_id: str, request: SubmitReviewRequest):
+    queue = await get_review_queue()
+    return await review_call(queue.submit, task_id, request.lease_token,
+        request.content, request.why, request.rating)
+
+@app.get("/review/queue")
+async def review_queue_status(status: Optional[str] = None):
+    queue = await get_review_queue()
+    return {"stats": await review_call(queue.get_stats),
+        "tasks": await review_call(queue.list_tasks, status)}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0",port=8000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import os
+
+from hitl.review_queue import ReviewQueue, ReviewError, LeaseError
+
+
+class RemoteDBManager:
+    # same interface as ChromaDBManager, backed by storage_server over pooled keep-alive connections.
+    # calls block like the local store does, the api runs them through asyncio.to_thread
+    def __init__(self, url, pool_size=None, timeout=60.0):
+        import httpx
+
+        pool_size = pool_size or int(os.getenv("NF_STORAGE_POOL", "16"))
+        self.url = url.rstrip("/")
+        self.http = httpx.Client(base_url=self.url, timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+        self.hnsw = self._call("GET", "/books")["hnsw"]
+        print(f"Connected to storage server at {self.url}")
+
+    def _call(self, method, path, **kwargs):
+        res = self.http.request(method, path, **kwargs)
+        res.raise_for_status()
+        return res.json()
+
+    def store_version(self, content, role, metadata=None):
+        try:
+            return self._call("POST", "/versions",
+                json={"content": content, "role": role, "metadata": metadata})["version_id"]
+        except Exception as e:
+            print(f"Failed to store version: {e}")
+            return None
+
+    def warm_up(self):
+        self._call("POST", "/warm-up")
+
+    def get_version(self, version_id, book=None):
+        try:
+            res = self.http.get(f"/versions/{version_id}", params={"book": book} if book else None)
+            if res.status_code == 404:
+                return None
+            res.raise_for_status()
+            return res.json()
+        except Exception as e:
+            print(f"Failed to get version {version_id}: {e}")
+            return None
+
+    def count(self, book=None):
+        return self._call("GET", "/count", params={"book": book} if book else None)["count"]
+
+    def list_books(self):
+        return self._call("GET", "/books")["books"]
+
+    def search(self, query, limit=5, book=None):
+        try:
+            return self._call("POST", "/search",
+                json={"query": query, "limit": limit, "book": book})["results"]
+        except Exception as e:
+            print(f"Search failed: {e}")
+            return []
+
+    def raw_query(self, query, limit=5, book=None):
+        return self._call("POST", "/raw-query", json={"query": query, "limit": limit, "book": book})
+
+    def get_documents(self, book=None, ids=None, where=None, include=None, limit=None, offset=None):
+        return self._call("POST", "/documents/get", json={"book": book, "ids": ids, "where": where,
+            "include": include, "limit": limit, "offset": offset})
+
+    def get_all_documents(self):
+        try:
+            return self._call("GET", "/documents")
+        except Exception as e:
+            print(f"Failed to get all documents: {e}")
+            return {"count": 0, "documents": [], "metadatas": [], "ids": []}
+
+    def rebuild_shard(self, book, **hnsw):
+        # copies the whole shard, give it far longer than a normal round trip
+        timeout = float(os.getenv("NF_STORAGE_REBUILD_TIMEOUT", "3600"))
+        return self._call("POST", f"/books/{book}/rebuild", json={"settings": hnsw}, timeout=timeout)["ok"]
+
+    def clear_collection(self):
+        try:
+            return self._call("POST", "/clear")["ok"]
+        except Exception as e:
+            print(f"Failed to clear collection:{e}")
+            return False
+
+
+class RemoteReviewQueue:
+    # forwards to the queue inside storage_server so leases hold across api workers
+    def __init__(self, db):
+        self.db = db
+
+    def _call(self, method, *args):
+        res = self.db.http.post("/review", json={"method": method, "args": list(args)})
+        if res.status_code == 404:
+            raise KeyError(res.json().get("detail"))
+        if res.status_code == 409:
+            raise LeaseError(res.json().get("detail"))
+        if res.status_code == 400:
+            raise ReviewError(res.json().get("detail"))
+        res.raise_for_status()
+        return res.json()["result"]
+
+    def enqueue(self, version_id, chapter=None, stage="Writer"):
+        return self._call("enqueue", version_id, chapter, stage)
+
+    def claim(self, reviewer, stage=None):
+        return self._call("claim", reviewer, stage)
+
+    def renew(self, task_id, lease_token):
+        return self._call("renew", task_id, lease_token)
+
+    def release(self, task_id, lease_token):
+        return self._call("release", task_id, lease_token)
+
+    def diff(self, task_id, content):
+        return self._call("diff", task_id, content)
+
+    def submit(self, task_id, lease_token, content=None, why="", rating=None):
+        return self._call("submit", task_id, lease_token, content, why, rating)
+
+    def get_stats(self):
+        return self._call("get_stats")
+
+    def list_tasks(self, status=None):
+        return self._call("list_tasks", status)
+
+
+def connect_store(collection_name="content_versions"):
+    # NF_STORAGE_URL=http://127.0.0.1:8100 switches every process to the shared storage server
+    url = os.getenv("NF_STORAGE_URL")
+    if url:
+        return RemoteDBManager(url)
+    from fastapi_server.chromadb_utils import ChromaDBManager
+    return ChromaDBManager(collection_name=collection_name)
+
+
+def connect_review_queue(db):
+    if isinstance(db, RemoteDBManager):
+        return RemoteReviewQueue(db)
+    return ReviewQueue(db)
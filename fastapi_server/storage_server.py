@@ -0,0 +1,166 @@
+# storage_server.py - the one process that owns data/chromadb when the API runs with several workers
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import sys
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from fastapi_server.chromadb_utils import ChromaDBManager, shard_slug
+from hitl.review_queue import ReviewQueue, ReviewError, LeaseError
+
+app = FastAPI(title="Gates of Morning storage")
+
+# sqlite and the hnsw files take one writer at a time, reads fan out over a pool
+write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-write")
+read_pool = ThreadPoolExecutor(max_workers=int(os.getenv("NF_STORAGE_READ_THREADS", "8")),
+                               thread_name_prefix="store-read")
+# rebuilds take minutes; the shard's own write lock holds off writes to that book only
+rebuild_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-rebuild")
+db = None
+review_queue = None
+# books being rebuilt; their writes wait here instead of parking the single writer thread on the shard lock
+rebuilding = {}
+
+@app.on_event("startup")
+async def startup_event():
+    global db, review_queue
+    # unlike the api, the storage process is useless without its store: fail loudly
+    db = await asyncio.get_running_loop().run_in_executor(
+        write_pool, lambda: ChromaDBManager(collection_name=os.getenv("NF_COLLECTION", "content_versions")))
+    # rebuilding open review tasks pages through the stored versions, keep it off the loop
+    review_queue = await asyncio.get_running_loop().run_in_executor(write_pool, lambda: ReviewQueue(db))
+    print(" Storage server ready")
+
+async def read(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(read_pool, lambda: fn(*args, **kwargs))
+
+async def write(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(write_pool, lambda: fn(*args, **kwargs))
+
+async def wait_for_rebuild(book):
+    done = rebuilding.get(shard_slug(book)) if book else None
+    if done is not None:
+        await done.wait()
+
+class StoreRequest(BaseModel):
+    content: str
+    role: str
+    metadata: Optional[Dict[str, Any]] = None
+
+class SearchRequest(BaseModel):
+    query: str
+    limit: int = 5
+    book: Optional[str] = None
+
+class GetRequest(BaseModel):
+    book: Optional[str] = None
+    ids: Optional[List[str]] = None
+    where: Optional[Dict[str, Any]] = None
+    include: Optional[List[str]] = None
+    limit: Optional[int] = None
+    offset: Optional[int] = None
+
+class RebuildRequest(BaseModel):
+    settings: Dict[str, int] = {}
+
+class ReviewCall(BaseModel):
+    method: str
+    args: List[Any] = []
+
+@app.get("/health")
+async def health():
+    return {"status": "ready" if db is not None else "starting"}
+
+@app.post("/versions")
+async def store_version(request: StoreRequest):
+    await wait_for_rebuild((request.metadata or {}).get("book"))
+    version_id = await write(db.store_version, request.content, request.role, request.metadata)
+    if version_id is None:
+        raise HTTPException(status_code=500, detail="Failed to store version")
+    return {"version_id": version_id}
+
+@app.get("/versions/{version_id}")
+async def get_version(version_id: str, book: Optional[str] = None):
+    version = await read(db.get_version, version_id, book)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Version not found: {version_id}")
+    return version
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    return {"results": await read(db.search, request.query, request.limit, request.book)}
+
+@app.post("/raw-query")
+async def raw_query(request: SearchRequest):
+    return await read(db.raw_query, request.query, request.limit, request.book)
+
+@app.post("/documents/get")
+async def get_documents(request: GetRequest):
+    return await read(db.get_documents, request.book, request.ids, request.where,
+                      request.include, request.limit, request.offset)
+
+@app.get("/documents")
+async def get_all_documents():
+    return await read(db.get_all_documents)
+
+@app.get("/count")
+async def count(book: Optional[str] = None):
+    return {"count": await read(db.count, book)}
+
+@app.get("/books")
+async def list_books():
+    return {"books": await read(db.list_books), "hnsw": db.hnsw}
+
+@app.post("/books/{book}/rebuild")
+async def rebuild(book: str, request: RebuildRequest):
+    key = shard_slug(book)
+    if key in rebuilding:
+        raise HTTPException(status_code=409, detail=f"{book} is already being rebuilt")
+    rebuilding[key] = asyncio.Event()
+    try:
+        ok = await asyncio.get_running_loop().run_in_executor(
+            rebuild_pool, lambda: db.rebuild_shard(book, **request.settings))
+    finally:
+        rebuilding.pop(key).set()
+    return {"ok": ok}
+
+@app.post("/clear")
+async def clear():
+    return {"ok": await write(db.clear_collection)}
+
+@app.post("/warm-up")
+async def warm_up():
+    await read(db.warm_up)
+    return {"status": "warm"}
+
+REVIEW_METHODS = {"enqueue", "claim", "renew", "release", "diff", "submit", "get_stats", "list_tasks"}
+# submit stores a version, so it goes through the writer like every other write
+REVIEW_WRITES = {"submit"}
+
+@app.post("/review")
+async def review(call: ReviewCall):
+    # the queue lives here so every api worker sees the same tasks and leases
+    if call.method not in REVIEW_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown review method: {call.method}")
+    try:
+        run = write if call.method in REVIEW_WRITES else read
+        if call.method in REVIEW_WRITES and call.args:
+            task = review_queue.tasks.get(call.args[0])
+            await wait_for_rebuild(task and task["book"])
+        return {"result": await run(getattr(review_queue, call.method), *call.args)}
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Not found: {e}")
+    except LeaseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ReviewError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+if __name__ == "__main__":
+    import uvicorn
+    # always a single worker: this process is the only one that opens the index
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("NF_STORAGE_PORT", "8100")), workers=1)
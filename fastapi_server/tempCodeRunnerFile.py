@@ -16,6 +16,7 @@ if PROJECT_ROOT not in sys.path:
 from ai_pipeline.ai_pipeline import rewrite, review
 from scraping.scrape_chapter import scrape_chapter
 from chromadb_utils import ChromaDBManager
+from fastapi_server.history import HistoryStore
 
 
 app = FastAPI(title="Morning Glory")
@@ -68,7 +69,7 @@ class SmartSearch:
         self.learned_stuff = {}
         self.explore_rate = 0.2
         self.learning_rate = 0.1
-        self.search_history = []
+        self.search_history = HistoryStore("searches", value_field="score", category_field="strategy")
 
         self.strategies = ["exact", "semantic", "expanded", "mixed"]
 
@@ -132,8 +133,7 @@ class SmartSearch:
             'query': query,
             'strategy': strategy,
             'score': score,
-            'results_count': len(results),
-            'time': datetime.now().isoformat()
+            'results_count': len(results)
         })
         log_rl_feedback("smart_search", score, {'strategy': strategy})
 
@@ -147,17 +147,17 @@ class SmartSearch:
         }
 
     def get_stats(self):
-        if not self.search_history:
+        stats = self.search_history.stats()
+        if not stats["total"]:
             return {"searches": 0, "avg_score": 0}
 
-        scores = [h['score'] for h in self.search_history]
-        strategies = [h['strategy'] for h in self.search_history]
-
+        day = stats["windows"]["24h"]
         return {
-            "searches": len(self.search_history),
-            "avg_score": np.mean(scores),
-            "recent_scores": scores[-5:],
-            "strategy_usage": {s: strategies.count(s) for s in set(strategies)},
+            "searches": stats["total"],
+            "avg_score": day["avg_score"],
+            "recent_scores": [h['score'] for h in self.search_history.latest(5)],
+            "strategy_usage": day["strategy"],
+            "windows": stats["windows"],
             "knowledge_base": len(self.learned_stuff)
         }
 
@@ -166,21 +166,19 @@ class WorkflowRunner:
     def __init__(self, db, searcher):
         self.db = db
         self.searcher = searcher
-        self.workflows = {}
+        self.workflows = HistoryStore("workflows", key_field="workflow_id")
 
     async def run_full_pipeline(self, url=None):
         workflow_id = uuid.uuid4().hex[:6]
         target_url = url or "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
 
-        workflow_data = {
-            'id': workflow_id,
+        workflow_data = self.workflows.append({
+            'workflow_id': workflow_id,
             'status': 'running',
             'steps': [],
-            'start': datetime.now().isoformat()}
-        self.workflows[workflow_id] = workflow_data
-        screenshot_file = "../data/screenshot.png"
+            'start': datetime.now().isoformat()})
         content_file = "../data/scraped.txt"
-        await scrape_chapter(target_url, screenshot_file, content_file)
+        await scrape_chapter(target_url, content_file, screenshot=False)
         with open(content_file, 'r', encoding='utf-8') as f:
             original = f.read()
 
@@ -201,10 +199,10 @@ class WorkflowRunner:
         review_version = self.db.store_version(reviewed, "ai_reviewer", {"source": rewrite_version})
         workflow_data['steps'].append({'step': 'review', 'version': review_version})
         log_rl_feedback("review", 8.0, {"version": review_version})
-        workflow_data.update({
-            'status': 'completed',
-            'end': datetime.now().isoformat(),
-            'files': [screenshot_file, content_file, "../data/rewritten.txt", "../data/reviewed.txt"]})
+        workflow_data = self.workflows.update(workflow_id,
+            status='completed',
+            end=datetime.now().isoformat(),
+            files=[content_file, "../data/rewritten.txt", "../data/reviewed.txt"])
         return {'workflow_id': workflow_id,
                 'status': 'success',
                 'original_size': len(original),
@@ -216,6 +214,8 @@ class WorkflowRunner:
 
 smart_searcher = SmartSearch(chroma_manager)
 workflow_runner = WorkflowRunner(chroma_manager, smart_searcher)
+smart_searcher.search_history.start_compaction()
+workflow_runner.workflows.start_compaction()
 
 
 @app.post("/search/smart")
@@ -243,7 +243,7 @@ async def run_workflow(url: str = None):
 
 @app.get("/workflow/{workflow_id}")
 def get_workflow(workflow_id: str):
-    return workflow_runner.workflows.get(workflow_id, {"err": "not found"})
+    return workflow_runner.workflows.get(workflow_id) or {"err": "not found"}
 
 
 @app.get("/stats")
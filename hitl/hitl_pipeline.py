@@ -19,12 +19,15 @@ def get_text(prompt,multiline=False):
     return input(prompt)
 
 
-def show_diff(old, new):
+def make_diff(old, new):
     if old==new:
-        return
-    diff = difflib.unified_diff(old.split('\n'),new.split('\n'), 
-                               fromfile='before',tofile='after',lineterm='')
-    for line in diff:
+        return []
+    return list(difflib.unified_diff(old.split('\n'),new.split('\n'),
+                                     fromfile='before',tofile='after',lineterm=''))
+
+
+def show_diff(old, new):
+    for line in make_diff(old, new):
         if line.startswith('+') and not line.startswith('+++'):
             print(f"\033[92m{line}\033[0m") 
         elif line.startswith('-') and not line.startswith('---'):
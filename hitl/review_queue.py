@@ -0,0 +1,237 @@
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from hitl.hitl_pipeline import make_diff
+
+# same chain as the cli pipeline: each stage works on the previous stage's version
+STAGES = ["Writer", "Reviewer", "Editor"]
+STAGE_ROLES = {"Writer": "human_writer",
+    "Reviewer": "human_reviewer",
+    "Editor": "human_editor"}
+LEASE_SECONDS = 15 * 60
+# the stage that picks up each role's output; ai_reviewer versions feed the first human stage
+NEXT_STAGE = {"ai_reviewer": STAGES[0],
+    **{STAGE_ROLES[stage]: nxt for stage, nxt in zip(STAGES, STAGES[1:])}}
+PAGE_SIZE = 500
+
+
+class ReviewError(Exception):
+    pass
+
+
+class LeaseError(ReviewError):
+    pass
+
+
+class ReviewQueue:
+    def __init__(self, db_manager, lease_seconds=LEASE_SECONDS, keep_done=1000, restore=True):
+        self.db = db_manager
+        self.lease_seconds = lease_seconds
+        self.tasks = {}
+        # finished tasks are only kept for stats, the oldest are dropped past keep_done
+        self.done = deque()
+        self.keep_done = keep_done
+        self.lock = threading.Lock()
+        if restore:
+            self.restore()
+
+    def _stored_versions(self):
+        roles = list(NEXT_STAGE) + [STAGE_ROLES[STAGES[-1]]]
+        for book in [None] + list(self.db.list_books()):
+            offset = 0
+            while True:
+                page = self.db.get_documents(book, where={"role": {"$in": roles}}, include=["metadatas"],
+                                             limit=PAGE_SIZE, offset=offset)
+                if not page["ids"]:
+                    break
+                yield from zip(page["ids"], page["metadatas"])
+                offset += len(page["ids"])
+
+    def restore(self):
+        # tasks live in memory, so rebuild the open ones after a restart: a version is still
+        # waiting for review until a version of the next stage points back at it
+        try:
+            versions = list(self._stored_versions())
+        except Exception as e:
+            print(f"Could not restore review tasks: {e}")
+            return 0
+        reviewed = {(meta.get("source"), meta.get("stage")) for _, meta in versions}
+        restored = 0
+        with self.lock:
+            for version_id, meta in sorted(versions, key=lambda v: v[1].get("timestamp", "")):
+                stage = NEXT_STAGE.get(meta.get("role"))
+                if stage is None or (version_id, stage) in reviewed:
+                    continue
+                task = self._new_task(version_id, meta, None, stage, meta.get("timestamp"))
+                self.tasks[task["task_id"]] = task
+                restored += 1
+        if restored:
+            print(f"Restored {restored} pending review tasks")
+        return restored
+
+    def _new_task(self, version_id, meta, chapter, stage, created=None):
+        return {"task_id": uuid.uuid4().hex[:8],
+            "version_id": version_id,
+            "book": meta.get("book"),
+            "chapter": chapter or meta.get("chapter") or meta.get("url") or version_id,
+            "stage": stage,
+            "status": "pending",
+            "claimed_by": None,
+            "lease_token": None,
+            "lease_expires": 0,
+            "created": created or datetime.utcnow().isoformat()}
+
+    def _expire_leases(self, now):
+        for task in self.tasks.values():
+            if task["status"] == "claimed" and task["lease_expires"] < now:
+                print(f"lease expired on {task['task_id']} ({task['claimed_by']})")
+                task.update({"status": "pending",
+                    "claimed_by": None,
+                    "lease_token": None,
+                    "lease_expires": 0})
+
+    def _check_lease(self, task_id, lease_token):
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise KeyError(task_id)
+        self._expire_leases(time.time())
+        if task["status"] != "claimed" or task["lease_token"] != lease_token:
+            raise LeaseError(f"task {task_id} is not leased with this token")
+        return task
+
+    def _public(self, task):
+        return {k: v for k, v in task.items() if k != "lease_token"}
+
+    def enqueue(self, version_id, chapter=None, stage=STAGES[0]):
+        if stage not in STAGES:
+            raise ReviewError(f"unknown stage: {stage}")
+        source = self.db.get_version(version_id)
+        if source is None:
+            raise KeyError(version_id)
+        task = self._new_task(version_id, source["metadata"], chapter, stage)
+        with self.lock:
+            for other in self.tasks.values():
+                # already queued, e.g. restored at startup
+                if (other["version_id"], other["stage"]) == (version_id, stage) and other["status"] != "done":
+                    return self._public(other)
+            self.tasks[task["task_id"]] = task
+        print(f"queued {stage} review of {version_id} as {task['task_id']}")
+        return self._public(task)
+
+    def claim(self, reviewer, stage=None):
+        now = time.time()
+        with self.lock:
+            self._expire_leases(now)
+            pending = [t for t in self.tasks.values()
+                if t["status"] == "pending" and (stage is None or t["stage"] == stage)]
+            if not pending:
+                return None
+            task = min(pending, key=lambda t: t["created"])
+            task.update({"status": "claimed",
+                "claimed_by": reviewer,
+                "lease_token": uuid.uuid4().hex,
+                "lease_expires": now + self.lease_seconds})
+            claimed = dict(task)
+        source = self.db.get_version(claimed["version_id"], claimed["book"])
+        claimed["content"] = source["content"] if source else ""
+        print(f"{reviewer} claimed {claimed['task_id']} ({claimed['stage']})")
+        return claimed
+
+    def renew(self, task_id, lease_token):
+        with self.lock:
+            task = self._check_lease(task_id, lease_token)
+            task["lease_expires"] = time.time() + self.lease_seconds
+            return self._public(task)
+
+    def release(self, task_id, lease_token):
+        with self.lock:
+            task = self._check_lease(task_id, lease_token)
+            task.update({"status": "pending",
+                "claimed_by": None,
+                "lease_token": None,
+                "lease_expires": 0})
+            return self._public(task)
+
+    def diff(self, task_id, content):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                raise KeyError(task_id)
+            version_id, book = task["version_id"], task["book"]
+        source = self.db.get_version(version_id, book)
+        return make_diff(source["content"] if source else "", content)
+
+    def submit(self, task_id, lease_token, content=None, why="", rating=None):
+        if rating is not None and not 1 <= rating <= 10:
+            raise ReviewError("rating must be 1-10")
+        with self.lock:
+            task = self._check_lease(task_id, lease_token)
+            # hold the task so a lease expiring mid-store can't hand it to someone else
+            task["status"] = "submitting"
+        try:
+            source = self.db.get_version(task["version_id"], task["book"])
+            if source is None:
+                raise KeyError(task["version_id"])
+            original = source["content"]
+            edited = original if content is None else content
+            diff = make_diff(original, edited)
+            meta = {"source": task["version_id"],
+                "stage": task["stage"],
+                "reviewer": task["claimed_by"],
+                "task_id": task_id,
+                "chapter": task["chapter"],
+                "edited": bool(diff),
+                "why": why or ""}
+            if rating is not None:
+                meta["rating"] = rating
+            for key in ("url", "book"):
+                if key in source["metadata"]:
+                    meta[key] = source["metadata"][key]
+            new_id = self.db.store_version(edited, STAGE_ROLES[task["stage"]], meta)
+            if new_id is None:
+                raise ReviewError("failed to store reviewed version")
+        except Exception:
+            with self.lock:
+                task["status"] = "claimed"
+            raise
+
+        with self.lock:
+            task.update({"status": "done",
+                "result_version": new_id,
+                "rating": rating,
+                "edited": bool(diff),
+                "lease_token": None,
+                "finished": datetime.utcnow().isoformat()})
+            self.done.append(task_id)
+            while len(self.done) > self.keep_done:
+                self.tasks.pop(self.done.popleft(), None)
+        next_task = None
+        idx = STAGES.index(task["stage"])
+        if idx + 1 < len(STAGES):
+            next_task = self.enqueue(new_id, task["chapter"], STAGES[idx + 1])
+        return {"task_id": task_id,
+            "version_id": new_id,
+            "diff": diff,
+            "next_task": next_task}
+
+    def get_stats(self):
+        with self.lock:
+            self._expire_leases(time.time())
+            tasks = list(self.tasks.values())
+        by_status = {}
+        for t in tasks:
+            by_status[t["status"]] = by_status.get(t["status"], 0) + 1
+        ratings = [t["rating"] for t in tasks if t.get("rating")]
+        return {"tasks": len(tasks),
+            "by_status": by_status,
+            "reviewers": sorted({t["claimed_by"] for t in tasks if t["claimed_by"]}),
+            "avg_rating": sum(ratings) / len(ratings) if ratings else 0,
+            "edits": sum(1 for t in tasks if t.get("edited"))}
+
+    def list_tasks(self, status=None):
+        with self.lock:
+            return [self._public(t) for t in self.tasks.values()
+                if status is None or t["status"] == status]
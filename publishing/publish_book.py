@@ -0,0 +1,227 @@
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from hitl.review_queue import STAGE_ROLES
+
+# versions that count as "final" for a chapter, newest wins
+FINAL_ROLES = ["ai_reviewer"] + list(STAGE_ROLES.values())
+PAGE_SIZE = 500
+MANIFEST = "manifest.json"
+# one publish per book at a time in this process
+_book_locks = {}
+_book_locks_lock = threading.Lock()
+
+
+def tmp_path(path):
+    # unique per writer, so a publish in another worker never writes over our half-written file
+    return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def natural_key(text):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", text)]
+
+
+def chapter_slug(chapter):
+    tail = chapter.split("/wiki/")[-1]
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", tail).strip("_")[:80] or "chapter"
+    return f"{slug}_{hashlib.sha1(chapter.encode('utf-8')).hexdigest()[:6]}"
+
+
+def chapter_title(chapter):
+    return chapter.rstrip("/").split("/")[-1].replace("_", " ")
+
+
+def latest_versions(db, book):
+    # only metadata is paged in, one small record per chapter is kept
+    latest = {}
+    offset = 0
+    while True:
+        page = db.get_documents(book, where={"role": {"$in": FINAL_ROLES}}, include=["metadatas"],
+                                limit=PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            break
+        for version_id, meta in zip(page["ids"], page["metadatas"]):
+            chapter = meta.get("chapter") or meta.get("url")
+            if not chapter:
+                continue
+            seen = latest.get(chapter)
+            if seen is None or meta.get("timestamp", "") > seen["timestamp"]:
+                latest[chapter] = {"version_id": version_id,
+                    "timestamp": meta.get("timestamp", ""),
+                    "role": meta.get("role", "")}
+        offset += len(page["ids"])
+    return latest
+
+
+def write_chapter(chapters_dir, slug, title, text):
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    md_path = os.path.join(chapters_dir, slug + ".md")
+    tmp = tmp_path(md_path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"## {title}\n\n")
+        for p in paragraphs:
+            f.write(p + "\n\n")
+    os.replace(tmp, md_path)
+
+    xhtml_path = os.path.join(chapters_dir, slug + ".xhtml")
+    tmp = tmp_path(xhtml_path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+                f"<head><title>{html.escape(title)}</title></head>\n<body>\n"
+                f"<h2>{html.escape(title)}</h2>\n")
+        for p in paragraphs:
+            f.write(f"<p>{html.escape(p).replace(chr(10), '<br/>')}</p>\n")
+        f.write("</body>\n</html>\n")
+    os.replace(tmp, xhtml_path)
+
+
+def assemble_markdown(out_dir, book, entries):
+    path = os.path.join(out_dir, "book.md")
+    tmp = tmp_path(path)
+    with open(tmp, "w", encoding="utf-8") as out:
+        out.write(f"# {book.replace('_', ' ')}\n\n")
+        for entry in entries:
+            with open(os.path.join(out_dir, "chapters", entry["slug"] + ".md"), encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+    os.replace(tmp, path)
+    return path
+
+
+def assemble_epub(out_dir, book, entries):
+    title = html.escape(book.replace("_", " "))
+    path = os.path.join(out_dir, "book.epub")
+    tmp = tmp_path(path)
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+        # the mimetype entry has to come first and stay uncompressed
+        z.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/container.xml",
+                   '<?xml version="1.0"?>\n'
+                   '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                   '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+                   'media-type="application/oebps-package+xml"/></rootfiles></container>')
+        manifest_items = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>']
+        spine, nav = [], []
+        for i, entry in enumerate(entries):
+            name = entry["slug"] + ".xhtml"
+            z.write(os.path.join(out_dir, "chapters", name), "OEBPS/" + name)
+            manifest_items.append(f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{i}"/>')
+            nav.append(f'<li><a href="{name}">{html.escape(entry["title"])}</a></li>')
+        z.writestr("OEBPS/nav.xhtml",
+                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+                   f'<head><title>{title}</title></head><body><nav epub:type="toc"><ol>'
+                   + "".join(nav) + "</ol></nav></body></html>")
+        z.writestr("OEBPS/content.opf",
+                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+                   '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                   f'<dc:identifier id="id">narrativeforge-{html.escape(book)}</dc:identifier>'
+                   f'<dc:title>{title}</dc:title><dc:language>en</dc:language>'
+                   f'<meta property="dcterms:modified">{datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}</meta>'
+                   '</metadata><manifest>' + "".join(manifest_items) + '</manifest>'
+                   '<spine>' + "".join(spine) + '</spine></package>')
+    os.replace(tmp, path)
+    return path
+
+
+def publish_book(db, book, out_dir=None, formats=("md", "epub")):
+    with _book_locks_lock:
+        lock = _book_locks.setdefault(book, threading.Lock())
+    with lock:
+        return _publish_book(db, book, out_dir, formats)
+
+
+def _publish_book(db, book, out_dir, formats):
+    if db.count(book) == 0:
+        raise KeyError(book)
+    out_dir = out_dir or os.path.join(project_root, "data", "publish", re.sub(r"[^A-Za-z0-9]+", "_", book))
+    chapters_dir = os.path.join(out_dir, "chapters")
+    os.makedirs(chapters_dir, exist_ok=True)
+
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    old = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            old = json.load(f).get("chapters", {})
+
+    latest = latest_versions(db, book)
+    entries, chapters = [], {}
+    regenerated, skipped = 0, 0
+    for chapter in sorted(latest, key=natural_key):
+        info = latest[chapter]
+        prev = old.get(chapter)
+        # same version means same text, no need to even fetch it
+        if prev and prev["version_id"] == info["version_id"] and os.path.exists(
+                os.path.join(chapters_dir, prev["slug"] + ".xhtml")):
+            entry = prev
+            skipped += 1
+        else:
+            res = db.get_documents(book, ids=[info["version_id"]], include=["documents"])
+            text = res["documents"][0]
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            slug = chapter_slug(chapter)
+            entry = {"version_id": info["version_id"],
+                "role": info["role"],
+                "hash": digest,
+                "slug": slug,
+                "title": chapter_title(chapter)}
+            if prev and prev["hash"] == digest and os.path.exists(os.path.join(chapters_dir, slug + ".xhtml")):
+                skipped += 1
+            else:
+                write_chapter(chapters_dir, slug, entry["title"], text)
+                regenerated += 1
+        chapters[chapter] = entry
+        entries.append(entry)
+
+    removed = 0
+    for chapter, entry in old.items():
+        if chapter not in chapters:
+            for ext in (".md", ".xhtml"):
+                path = os.path.join(chapters_dir, entry["slug"] + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+
+    outputs = {}
+    changed = regenerated or removed or not os.path.exists(manifest_path)
+    if "md" in formats:
+        path = os.path.join(out_dir, "book.md")
+        outputs["md"] = assemble_markdown(out_dir, book, entries) if changed or not os.path.exists(path) else path
+    if "epub" in formats:
+        path = os.path.join(out_dir, "book.epub")
+        outputs["epub"] = assemble_epub(out_dir, book, entries) if changed or not os.path.exists(path) else path
+
+    tmp = tmp_path(manifest_path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"book": book, "published": datetime.utcnow().isoformat(), "chapters": chapters}, f, indent=1)
+    os.replace(tmp, manifest_path)
+
+    print(f"published {book}: {len(entries)} chapters, {regenerated} regenerated, {skipped} unchanged, {removed} removed")
+    return {"book": book,
+        "chapters": len(entries),
+        "regenerated": regenerated,
+        "unchanged": skipped,
+        "removed": removed,
+        "outputs": outputs}
+
+
+if __name__ == "__main__":
+    from fastapi_server.storage_client import connect_store
+
+    book = sys.argv[1] if len(sys.argv) > 1 else "The_Gates_of_Morning"
+    print(publish_book(connect_store(collection_name="content_versions"), book))
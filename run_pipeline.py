@@ -6,16 +6,22 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 if project_root not in sys.path:
     sys.path.insert(0,project_root)
 
-from fastapi_server.chromadb_utils import ChromaDBManager
+from fastapi_server.storage_client import connect_store, connect_review_queue
 from fastapi_server.main import WorkflowRunner, SmartSearch
+from scraping.scrape_chapter import close_browser
 
 
 async def run_pipeline_and_store():
-    db = ChromaDBManager(collection_name="content_versions")
+    db = connect_store(collection_name="content_versions")
     searcher = SmartSearch(db)
-    runner = WorkflowRunner(db, searcher)
+    # with NF_STORAGE_URL set this is the storage server's queue, so the chapter shows up for reviewers
+    # right away; a local queue only lives for this run, the api restores its tasks from the store
+    runner = WorkflowRunner(db, searcher, review_queue=connect_review_queue(db))
     url = "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
-    result = await runner.run_full_pipeline(url)
+    try:
+        result = await runner.run_full_pipeline(url)
+    finally:
+        await close_browser()
     print("Workflow run completed:")
     print(result)
 
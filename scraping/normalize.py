@@ -0,0 +1,92 @@
+import os
+import re
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from ai_pipeline.scheduler import estimate_tokens
+
+ARROWS = {"←", "→"}
+# footnote ids are short, "[1914]" is a year
+FOOTNOTE_LINE = re.compile(r"^\[(\d{1,3})\]\s*(.*)$")
+FOOTNOTE_MARK = re.compile(r"\[(\d{1,3})\]")
+DROP_CAP_REST = re.compile(r"[A-Z]+\b")
+BACKREF_LINE = re.compile(r"^↑\s*(.*)$")
+LAYOUT_NOISE = re.compile(r"\[edit\]|[\u200b\ufeff]")
+
+
+def strip_nav_header(lines):
+    # wikisource puts "← / Book 1 / Title / by Author / Book 1. Chapter 1 / Chapter 2 / →"
+    # before the first blank line; only a block with the arrow lines is treated as that header
+    end = next((i for i, line in enumerate(lines) if not line.strip()), len(lines))
+    header = lines[:end]
+    if any(line.strip() in ARROWS for line in header):
+        return lines[end:], header
+    return lines, []
+
+
+def join_drop_caps(lines):
+    # a decorated initial comes out as its own line: "D" / "ICK standing on...". the rest of the
+    # word is all caps and the line goes on in lower case, which tells it apart from "I" / "THE
+    # CANOE BUILDER" (a heading) and "A" / "Boat came." (a new sentence)
+    out = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        nxt = lines[i + 1] if i + 1 < len(lines) else ""
+        if (len(line) == 1 and line.isupper() and DROP_CAP_REST.match(nxt)
+                and any(c.islower() for c in nxt)):
+            out.append(line + lines[i + 1])
+            i += 2
+            continue
+        out.append(line)
+        i += 1
+    return out
+
+
+def normalize_chapter(raw):
+    lines = [LAYOUT_NOISE.sub("", line).replace("\xa0", " ").rstrip() for line in raw.splitlines()]
+    lines, header = strip_nav_header(lines)
+
+    body, footnotes, removed = [], [], len(header)
+    for line in lines:
+        stripped = line.strip()
+        if stripped in ARROWS:
+            removed += 1
+            continue
+        note = FOOTNOTE_LINE.match(stripped)
+        backref = BACKREF_LINE.match(stripped)
+        if note:
+            footnotes.append({"id": note.group(1), "text": note.group(2)})
+            removed += 1
+            continue
+        if backref:
+            footnotes.append({"id": str(len(footnotes) + 1), "text": backref.group(1)})
+            removed += 1
+            continue
+        body.append(line)
+
+    # only markers that point at a collected footnote are dropped
+    ids = {note["id"] for note in footnotes}
+    body = [FOOTNOTE_MARK.sub(lambda m: "" if m.group(1) in ids else m.group(0), line) for line in body]
+    text = "\n".join(join_drop_caps(body))
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    return {"text": text,
+        "footnotes": footnotes,
+        "token_estimate": estimate_tokens(text),
+        "raw_token_estimate": estimate_tokens(raw),
+        "removed_lines": removed}
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(project_root, "data", "scraped.txt")
+    with open(path, encoding="utf-8") as f:
+        result = normalize_chapter(f.read())
+    print(result["text"][:400])
+    print("...")
+    print(f"footnotes: {[n['id'] for n in result['footnotes']]}")
+    print(f"tokens: {result['raw_token_estimate']} -> {result['token_estimate']}, "
+          f"{result['removed_lines']} lines removed")
@@ -1,16 +1,48 @@
 import asyncio
-from playwright.async_api import async_playwright
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from scraping.screenshots import get_store
 
 url = "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
-ss_path = "ss.png" 
 txt_path = "content.txt"
 
-async def scrape_chapter(url, screenshot_file,text_file):
-   async with async_playwright() as p:
-       browser = await p.chromium.launch(headless=True)
-       page = await browser.new_page()
+# one browser per event loop, launched on first use (or by the server warm-up) and reused
+_browser = {"loop": None, "lock": None, "playwright": None, "browser": None}
+
+async def get_browser():
+   loop = asyncio.get_running_loop()
+   if _browser["loop"] is not loop:
+       _browser.update({"loop": loop, "lock": asyncio.Lock(), "playwright": None, "browser": None})
+   async with _browser["lock"]:
+       browser = _browser["browser"]
+       if browser is None or not browser.is_connected():
+           from playwright.async_api import async_playwright
+           if _browser["playwright"] is None:
+               _browser["playwright"] = await async_playwright().start()
+           browser = await _browser["playwright"].chromium.launch(headless=True)
+           _browser["browser"] = browser
+   return browser
+
+async def close_browser():
+   if _browser["loop"] is asyncio.get_running_loop():
+       if _browser["browser"] is not None:
+           await _browser["browser"].close()
+       if _browser["playwright"] is not None:
+           await _browser["playwright"].stop()
+   _browser.update({"loop": None, "lock": None, "playwright": None, "browser": None})
+
+async def scrape_chapter(url, text_file, screenshot=True, store=None):
+   # returns as soon as the text is saved; the full-page capture, encoding and dedup run in the
+   # background. returns a task resolving to the stored screenshot, or None
+   browser = await get_browser()
+   page = await browser.new_page()
+   try:
        await page.goto(url)
-       await page.screenshot(path=screenshot_file, full_page=True)  
     
        content_div = await page.query_selector("#mw-content-text")
        if content_div:
@@ -19,7 +51,29 @@ async def scrape_chapter(url, screenshot_file,text_file):
            text = "couldn't find the main content"
        with open(text_file,"w",encoding="utf-8") as f:
            f.write(text)
-       await browser.close()
+   except BaseException:
+       await page.close()
+       raise
+
+   if not screenshot:
+       await page.close()
+       return None
+   return asyncio.create_task(capture_screenshot(page, url, store or get_store()))
+
+async def capture_screenshot(page, url, store):
+   try:
+       data = await page.screenshot(full_page=True, type="jpeg", quality=80)
+   finally:
+       await page.close()
+   return await asyncio.wrap_future(store.submit(data, url))
+
+async def main():
+   try:
+       shot = await scrape_chapter(url, txt_path)
+       print(await shot)
+   finally:
+       await close_browser()
+
 if __name__ == "__main__":
-    asyncio.run(scrape_chapter(url, ss_path, txt_path))
-    print(f"scraped chapter - saved screenshot and text")
\ No newline at end of file
+    asyncio.run(main())
+    print(f"scraped chapter - saved screenshot and text")
@@ -0,0 +1,173 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows: the index is only safe with a single process there
+    fcntl = None
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "screenshots")
+
+
+def load_pillow():
+    # Pillow is optional, without it screenshots are kept as captured and deduped by exact hash
+    try:
+        from PIL import Image
+        return Image
+    except ImportError:
+        return None
+
+
+def dhash(image, size=16):
+    # difference hash: robust to recompression and tiny rendering changes
+    small = image.convert("L").resize((size + 1, size))
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ScreenshotStore:
+    # max_distance enables near-duplicate matching on the perceptual hash; off by default because
+    # full-page text screenshots of different chapters can hash alike
+    def __init__(self, root=DEFAULT_DIR, quality=70, thumb_size=(320, 320), max_distance=None, workers=2):
+        self.root = root
+        self.quality = quality
+        self.thumb_size = thumb_size
+        self.max_distance = max_distance
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="screenshot")
+        self.lock = threading.Lock()
+        # hashes being encoded right now, so a concurrent capture of the same page waits for it
+        self.pending = {}
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(root, exist_ok=True)
+        # every worker and run_pipeline.py share index.json, it is re-read under this before each change
+        self.lock_file = open(self.index_path + ".lock", "a")
+        self.index = {}
+        # index.json is only ever swapped in whole, reading it needs no lock
+        self._load_index()
+
+    def submit(self, data, url):
+        # encoding and disk writes happen on the pool, the scraper only hands over the bytes
+        return self.pool.submit(self._store, data, url)
+
+    @contextmanager
+    def _index_lock(self):
+        # holds the thread lock and the file lock, with self.index fresh from disk
+        with self.lock:
+            if fcntl is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                self._load_index()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def _find_duplicate(self, key, perceptual, size):
+        if key in self.index:
+            return key
+        if perceptual and self.max_distance is not None:
+            for other, entry in self.index.items():
+                if (entry.get("perceptual") and entry.get("size") == size
+                        and hamming(perceptual, entry["perceptual"]) <= self.max_distance):
+                    return other
+        return None
+
+    def _save_index(self):
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _store(self, data, url):
+        Image = load_pillow()
+        image = Image.open(io.BytesIO(data)).convert("RGB") if Image else None
+        if image:
+            # hash decoded pixels so identical renders match whatever the encoder did
+            key = hashlib.sha256(repr(image.size).encode() + image.tobytes()).hexdigest()
+            perceptual, size = dhash(image), list(image.size)
+        else:
+            key, perceptual, size = hashlib.sha256(data).hexdigest(), None, None
+
+        while True:
+            with self._index_lock():
+                dup = self._find_duplicate(key, perceptual, size)
+                if dup:
+                    entry = self.index[dup]
+                    if url not in entry["urls"]:
+                        entry["urls"].append(url)
+                        self._save_index()
+                    return {"hash": dup, "duplicate": True, **entry}
+                encoding = self.pending.get(key)
+                if encoding is None:
+                    self.pending[key] = threading.Event()
+                    break
+            # same image is being written by another capture, check again once it is indexed
+            encoding.wait()
+
+        try:
+            if image:
+                path = os.path.join(self.root, f"{key}.webp")
+                image.save(path, "WEBP", quality=self.quality, method=4)
+                thumb = image.copy()
+                thumb.thumbnail(self.thumb_size)
+                thumb_path = os.path.join(self.root, f"{key}_thumb.webp")
+                thumb.save(thumb_path, "WEBP", quality=self.quality)
+            else:
+                path = os.path.join(self.root, f"{key}.jpg")
+                with open(path, "wb") as f:
+                    f.write(data)
+                thumb_path = None
+
+            entry = {"file": path,
+                "thumbnail": thumb_path,
+                "bytes": os.path.getsize(path),
+                "perceptual": perceptual,
+                "size": size,
+                "urls": [url],
+                "created": datetime.utcnow().isoformat()}
+            with self._index_lock():
+                # another process may have stored the same image meanwhile, keep its urls too
+                if key in self.index:
+                    urls = self.index[key]["urls"]
+                    entry["urls"] = urls + [url] if url not in urls else urls
+                self.index[key] = entry
+                self._save_index()
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+        print(f"stored screenshot {os.path.basename(path)} ({entry['bytes']} bytes)")
+        return {"hash": key, "duplicate": False, **entry}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ScreenshotStore()
+    return _store
@@ -0,0 +1,64 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+class FakeStore:
+    # the slice of ChromaDBManager that the queue and the publisher use, in a dict
+    def __init__(self):
+        self.versions = {}
+        self.started = datetime(2024, 1, 1)
+
+    def store_version(self, content, role, metadata=None):
+        version_id = f"{role}_{len(self.versions)}"
+        # strictly increasing timestamps, the real store's can collide within a second
+        timestamp = (self.started + timedelta(seconds=len(self.versions))).isoformat()
+        self.versions[version_id] = (content, {"role": role, "timestamp": timestamp,
+                                               "version_id": version_id, **(metadata or {})})
+        return version_id
+
+    def get_version(self, version_id, book=None):
+        if version_id not in self.versions:
+            return None
+        content, meta = self.versions[version_id]
+        return {"version_id": version_id, "content": content, "metadata": meta}
+
+    def _matches(self, meta, book, where):
+        # like the real store, book=None is the unsharded collection: versions without a book
+        if meta.get("book") != book:
+            return False
+        for field, cond in (where or {}).items():
+            if meta.get(field) not in cond["$in"]:
+                return False
+        return True
+
+    def get_documents(self, book=None, ids=None, where=None, include=None, limit=None, offset=None):
+        items = [(i, self.versions[i]) for i in (ids or self.versions) if i in self.versions]
+        items = [(i, v) for i, v in items if self._matches(v[1], book, where)]
+        items = items[offset or 0:(offset or 0) + limit if limit else None]
+        return {"ids": [i for i, _ in items],
+            "documents": [c for _, (c, _) in items],
+            "metadatas": [m for _, (_, m) in items]}
+
+    def count(self, book=None):
+        if book is None:
+            return len(self.versions)
+        return len(self.get_documents(book)["ids"])
+
+    def list_books(self):
+        books = {}
+        for _, meta in self.versions.values():
+            if meta.get("book"):
+                books[meta["book"]] = books.get(meta["book"], 0) + 1
+        return books
+
+
+@pytest.fixture
+def store():
+    return FakeStore()
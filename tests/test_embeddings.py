@@ -0,0 +1,65 @@
+import pytest
+
+from fastapi_server.embeddings import CachedEmbeddingFunction, EmbeddingMismatch
+
+
+class CountingModel:
+    def __init__(self, dims=3):
+        self.dims = dims
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        return [[float(len(t))] * self.dims for t in texts]
+
+
+def embedder(tmp_path, dims=3, **kwargs):
+    ef = CachedEmbeddingFunction(backend="sentence-transformers", model="fake-model", batch_size=2,
+                                 cache_path=str(tmp_path / "cache.sqlite3"), **kwargs)
+    ef._model = CountingModel(dims)
+    return ef
+
+
+def test_cache_hits_skip_the_model(tmp_path):
+    ef = embedder(tmp_path)
+    first = ef(["a", "bb", "a", "ccc"])
+    assert first == [[1.0] * 3, [2.0] * 3, [1.0] * 3, [3.0] * 3]
+    assert sorted(ef._model.seen) == ["a", "bb", "ccc"]
+    assert ef.stats["batches"] == 2
+
+    # a new process with the same cache file embeds nothing it has seen
+    again = embedder(tmp_path)
+    assert again(["ccc", "bb", "dddd"]) == [[3.0] * 3, [2.0] * 3, [4.0] * 3]
+    assert again._model.seen == ["dddd"]
+    assert again.stats["cache_hits"] == 2
+
+
+def test_queries_bypass_the_cache(tmp_path):
+    ef = embedder(tmp_path)
+    ef.embed_one("a query")
+    ef.embed_one("a query")
+    assert ef._model.seen == ["a query", "a query"]
+    assert ef.cache.get_many([ef._key("a query")]) == {}
+
+
+def test_opening_checks_model_without_loading_it(tmp_path):
+    ef = embedder(tmp_path)
+    ef._model = None
+    # collections from before the model was recorded hold default MiniLM vectors
+    with pytest.raises(EmbeddingMismatch):
+        ef.check_compatible("content_versions", {"hnsw:M": 16})
+    ef.check_compatible("content_versions", {"embedding:model": "fake-model", "embedding:dim": 3})
+    assert ef._model is None
+    assert ef.signature() == {"embedding:model": "fake-model"}
+
+
+def test_dimension_checked_on_first_vectors(tmp_path):
+    ef = embedder(tmp_path, dims=5)
+    ef.check_compatible("content_versions", {"embedding:model": "fake-model", "embedding:dim": 3})
+    with pytest.raises(EmbeddingMismatch):
+        ef(["text"])
+
+    ok = embedder(tmp_path, dims=3)
+    ok.check_compatible("content_versions", {"embedding:model": "fake-model", "embedding:dim": 3})
+    ok(["text"])
+    assert ok.signature() == {"embedding:model": "fake-model", "embedding:dim": 3}
@@ -0,0 +1,58 @@
+import json
+
+from fastapi_server.history import HistoryStore
+
+
+def workflows(tmp_path, **kwargs):
+    return HistoryStore("workflows", root=str(tmp_path), key_field="workflow_id", **kwargs)
+
+
+def test_workers_see_each_others_records(tmp_path):
+    first, second = workflows(tmp_path, maxlen=3), workflows(tmp_path, maxlen=3)
+    for i in range(5):
+        (first if i % 2 else second).append({"workflow_id": f"w{i}", "status": "running"})
+    second.update("w4", status="completed")
+
+    for store in (first, second):
+        assert [r["workflow_id"] for r in store.latest(10)] == ["w2", "w3", "w4"]
+        assert store.get("w4")["status"] == "completed"
+        assert store.get("w0") is None
+        assert store.stats()["total"] == 5
+
+
+def test_update_of_an_evicted_record(tmp_path):
+    store = workflows(tmp_path, maxlen=2)
+    for i in range(4):
+        store.append({"workflow_id": f"w{i}", "status": "running"})
+    with open(store.path) as f:
+        started = json.loads(f.readline())["ts"]
+
+    store.update("w0", status="completed")
+    other = workflows(tmp_path, maxlen=2)
+    for s in (store, other):
+        assert s.stats()["total"] == 4
+        assert [r["workflow_id"] for r in s.latest(10)] == ["w2", "w3"]
+
+    assert store.compact()
+    with open(store.path) as f:
+        records = [json.loads(line) for line in f]
+    assert [r["workflow_id"] for r in records] == ["w0", "w1", "w2", "w3"]
+    assert records[0]["status"] == "completed"
+    assert records[0]["ts"] == started
+    assert "_update" not in records[0]
+
+
+def test_compaction_is_picked_up_by_other_workers(tmp_path):
+    first, second = workflows(tmp_path, maxlen=10), workflows(tmp_path, maxlen=10)
+    for i in range(3):
+        first.append({"workflow_id": f"w{i}", "status": "running"})
+        first.update(f"w{i}", status="completed")
+    assert first.compact()
+    with open(first.path) as f:
+        assert len(f.readlines()) == 3
+
+    second.append({"workflow_id": "w3", "status": "running"})
+    for store in (first, second):
+        assert [r["workflow_id"] for r in store.latest(10)] == ["w0", "w1", "w2", "w3"]
+        assert store.get("w1")["status"] == "completed"
+        assert store.stats()["total"] == 4
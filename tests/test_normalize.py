@@ -0,0 +1,61 @@
+import os
+import re
+import sys
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from scraping.normalize import normalize_chapter
+
+
+@pytest.fixture(scope="module")
+def scraped():
+    with open(os.path.join(project_root, "data", "scraped.txt"), encoding="utf-8") as f:
+        raw = f.read()
+    return raw, normalize_chapter(raw)
+
+
+def test_strips_navigation_and_markers(scraped):
+    raw, result = scraped
+    assert "←" in raw and "→" in raw
+    assert "←" not in result["text"] and "→" not in result["text"]
+    assert not re.search(r"\[\d+\]", result["text"])
+    assert result["text"].splitlines()[0] == '"The Gates of Morning"'
+
+
+def test_keeps_footnotes(scraped):
+    _, result = scraped
+    # the saved scrape only has the trailing [1]..[7] lines, their text never made it into the dump
+    assert [n["id"] for n in result["footnotes"]] == [str(i) for i in range(1, 8)]
+
+
+def test_joins_drop_cap(scraped):
+    _, result = scraped
+    assert "DICK standing on a ledge of coral" in result["text"]
+    assert "\nD\n" not in result["text"]
+
+
+def test_shrinks_token_estimate(scraped):
+    _, result = scraped
+    assert result["token_estimate"] < result["raw_token_estimate"]
+
+
+def test_leaves_plain_text_alone():
+    text = "by the time the sun rose, Dick was awake.\n\nHe walked."
+    result = normalize_chapter(text)
+    assert result["text"] == text
+    assert result["removed_lines"] == 0
+
+
+def test_drop_cap_needs_the_rest_of_a_word():
+    result = normalize_chapter("I\nTHE CANOE BUILDER\n\nA\nBoat came.\n\nD\nICK stood up.")
+    assert result["text"].splitlines() == ["I", "THE CANOE BUILDER", "", "A", "Boat came.", "", "DICK stood up."]
+
+
+def test_keeps_bracketed_numbers_that_are_not_footnotes():
+    result = normalize_chapter("It was [1914] when he came.[1]\n\n[1] A note.")
+    assert result["text"] == "It was [1914] when he came."
+    assert result["footnotes"] == [{"id": "1", "text": "A note."}]
@@ -0,0 +1,66 @@
+import threading
+import zipfile
+
+import pytest
+
+from publishing.publish_book import publish_book
+
+
+def add_chapters(store, n, book="Book"):
+    for i in range(1, n + 1):
+        store.store_version(f"Chapter {i} text.\n\nSecond paragraph.", "ai_reviewer",
+                            {"chapter": f"https://x/wiki/{book}/Chapter_{i}", "book": book})
+
+
+def test_only_changed_chapters_are_regenerated(store, tmp_path):
+    add_chapters(store, 3)
+    first = publish_book(store, "Book", str(tmp_path))
+    assert (first["chapters"], first["regenerated"]) == (3, 3)
+
+    again = publish_book(store, "Book", str(tmp_path))
+    assert (again["regenerated"], again["unchanged"]) == (0, 3)
+
+    store.store_version("Edited chapter 2.", "human_editor",
+                        {"chapter": "https://x/wiki/Book/Chapter_2", "book": "Book"})
+    edited = publish_book(store, "Book", str(tmp_path))
+    assert (edited["regenerated"], edited["unchanged"]) == (1, 2)
+
+    with open(edited["outputs"]["md"], encoding="utf-8") as f:
+        book = f.read()
+    assert "Edited chapter 2." in book
+    assert book.index("Chapter 1") < book.index("Edited chapter 2.") < book.index("Chapter 3")
+
+
+def test_epub_is_well_formed(store, tmp_path):
+    add_chapters(store, 2)
+    result = publish_book(store, "Book", str(tmp_path))
+    with zipfile.ZipFile(result["outputs"]["epub"]) as z:
+        first = z.infolist()[0]
+        assert first.filename == "mimetype" and first.compress_type == zipfile.ZIP_STORED
+        names = z.namelist()
+    assert "OEBPS/content.opf" in names
+    assert sum(name.endswith(".xhtml") and "nav" not in name for name in names) == 2
+
+
+def test_unknown_book(store, tmp_path):
+    with pytest.raises(KeyError):
+        publish_book(store, "Missing", str(tmp_path))
+
+
+def test_concurrent_publishes_of_one_book(store, tmp_path):
+    add_chapters(store, 20)
+    errors = []
+
+    def run():
+        try:
+            publish_book(store, "Book", str(tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert not [p for p in tmp_path.rglob("*.tmp")]
@@ -0,0 +1,82 @@
+import pytest
+
+from hitl import review_queue as review_module
+from hitl.review_queue import LeaseError, ReviewQueue
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = {"t": 1000.0}
+    monkeypatch.setattr(review_module.time, "time", lambda: clock["t"])
+    return clock
+
+
+def reviewed_chapter(store, chapter="https://x/wiki/Book/Chapter_1"):
+    return store.store_version("ai text", "ai_reviewer", {"chapter": chapter, "book": "Book"})
+
+
+def test_expired_lease_goes_back_to_the_queue(store, now):
+    queue = ReviewQueue(store, lease_seconds=60)
+    queue.enqueue(reviewed_chapter(store))
+
+    first = queue.claim("ann")
+    assert first["content"] == "ai text"
+    assert queue.claim("bob") is None
+
+    now["t"] += 61
+    second = queue.claim("bob")
+    assert second["task_id"] == first["task_id"]
+    assert second["claimed_by"] == "bob"
+    with pytest.raises(LeaseError):
+        queue.submit(first["task_id"], first["lease_token"], "ann's edit")
+
+    result = queue.submit(second["task_id"], second["lease_token"], "bob's edit", why="tighter", rating=8)
+    content, meta = store.versions[result["version_id"]]
+    assert content == "bob's edit"
+    assert meta["role"] == "human_writer"
+    assert meta["reviewer"] == "bob"
+    assert meta["book"] == "Book"
+    assert result["next_task"]["stage"] == "Reviewer"
+
+
+def test_renew_keeps_the_lease(store, now):
+    queue = ReviewQueue(store, lease_seconds=60)
+    queue.enqueue(reviewed_chapter(store))
+    task = queue.claim("ann")
+
+    now["t"] += 50
+    queue.renew(task["task_id"], task["lease_token"])
+    now["t"] += 50
+    assert queue.claim("bob") is None
+    queue.submit(task["task_id"], task["lease_token"])
+
+
+def test_restart_restores_open_tasks(store, now):
+    queue = ReviewQueue(store)
+    first, second = reviewed_chapter(store), reviewed_chapter(store, "https://x/wiki/Book/Chapter_2")
+    queue.enqueue(first)
+    queue.enqueue(second)
+    task = queue.claim("ann")
+    queue.submit(task["task_id"], task["lease_token"], "edited")
+    claimed = queue.claim("bob", stage="Writer")
+
+    restarted = ReviewQueue(store)
+    open_tasks = sorted((t["version_id"], t["stage"], t["status"]) for t in restarted.list_tasks())
+    # the claimed chapter comes back pending, leases don't survive a restart
+    human = next(v for v, (_, meta) in store.versions.items() if meta["role"] == "human_writer")
+    assert open_tasks == sorted([(claimed["version_id"], "Writer", "pending"),
+                                 (human, "Reviewer", "pending")])
+    # enqueueing a restored version again hands back the same task
+    again = restarted.enqueue(claimed["version_id"])
+    assert len(restarted.list_tasks()) == 2
+    assert again["stage"] == "Writer"
+
+
+def test_finished_tasks_are_evicted(store, now):
+    queue = ReviewQueue(store, keep_done=2)
+    for i in range(4):
+        queue.enqueue(reviewed_chapter(store, f"https://x/wiki/Book/Chapter_{i}"))
+        task = queue.claim("ann", stage="Writer")
+        queue.submit(task["task_id"], task["lease_token"])
+    assert len(queue.list_tasks("done")) == 2
+    assert len(queue.list_tasks("pending")) == 4
@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from ai_pipeline import scheduler as scheduler_module
+from ai_pipeline.llm_stub import SimulatedClock, StubLLM
+from ai_pipeline.scheduler import BATCH, INTERACTIVE, CircuitBreaker, CircuitOpen, LLMScheduler
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock()
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    # take the top of every jitter range so delays are predictable
+    monkeypatch.setattr(scheduler_module.random, "uniform", lambda a, b: b)
+
+
+def test_retries_429_after_retry_after(clock):
+    stub = StubLLM(rpm=5, clock=clock)
+    sched = LLMScheduler(rpm=60, base_delay=1.0, clock=clock, sleep=clock.sleep)
+
+    for i in range(10):
+        assert sched.call(stub.generate, f"chapter {i}") == f"CHAPTER {i}"
+
+    stats = sched.get_stats()
+    assert stub.stats["429"] == 1
+    assert stats["rate_limited"] == stats["retries"] == 1
+    assert stats["succeeded"] == 10
+    # the 6th call hits the quota at t=0 and sleeps retry_after (60s) plus up to base_delay
+    assert clock.now >= 60
+    assert stats["circuit"] == "closed"
+
+
+def test_quota_pushback_slows_down_without_opening_circuit(clock):
+    stub = StubLLM(rpm=10, send_retry_after=False, clock=clock)
+    sched = LLMScheduler(rpm=60, max_retries=10, base_delay=1.0, max_delay=8.0,
+                         breaker=CircuitBreaker(failure_threshold=5, clock=clock),
+                         clock=clock, sleep=clock.sleep)
+
+    rates = []
+
+    def generate(prompt):
+        rates.append(sched.get_stats()["rpm"])
+        return stub.generate(prompt)
+
+    for i in range(30):
+        sched.call(generate, f"chapter {i}")
+
+    stats = sched.get_stats()
+    assert stub.stats["429"] >= 5
+    assert stats["rejected"] == 0
+    assert stats["failed"] == 0
+    assert stats["circuit"] == "closed"
+    # each 429 halves the request rate, successes bring it back up
+    assert min(rates) <= 15
+
+
+def test_interactive_calls_jump_the_batch_queue(clock):
+    gate = threading.Event()
+
+    def gated_sleep(seconds):
+        gate.wait(5)
+        clock.sleep(seconds)
+
+    sched = LLMScheduler(rpm=6, clock=clock, sleep=gated_sleep)
+    order = []
+
+    def record(prompt):
+        order.append(prompt)
+        return prompt
+
+    sched.call(record, "first")  # drains the single-token bucket
+
+    def queue(prompt, priority):
+        queued = len(sched.waiting)
+        t = threading.Thread(target=sched.call, args=(record, prompt, priority))
+        t.start()
+        while len(sched.waiting) == queued:
+            time.sleep(0.001)
+        return t
+
+    threads = [queue("batch 1", BATCH), queue("batch 2", BATCH), queue("interactive", INTERACTIVE)]
+    gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert order == ["first", "interactive", "batch 1", "batch 2"]
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_after=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.sleep(30)
+    assert breaker.state == "half_open"
+    assert [breaker.allow() for _ in range(50)].count(True) == 1
+
+    # failed probe: open for another full cooldown
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.sleep(30)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert all(breaker.allow() for _ in range(10))
+
+
+def test_outage_opens_circuit_and_rejects(clock):
+    def down(prompt):
+        raise RuntimeError("500 internal error")
+
+    sched = LLMScheduler(max_retries=10, breaker=CircuitBreaker(failure_threshold=3, clock=clock),
+                         clock=clock, sleep=clock.sleep)
+
+    with pytest.raises(CircuitOpen):
+        sched.call(down, "chapter")
+
+    stats = sched.get_stats()
+    assert stats["retries"] == 3
+    assert stats["rejected"] == 1
+    assert stats["circuit"] == "open"
+
+
+def test_quota_is_split_between_processes(monkeypatch):
+    monkeypatch.setenv("NF_LLM_RPM", "60")
+    monkeypatch.setenv("NF_LLM_TPM", "1000")
+    monkeypatch.setenv("NF_LLM_PROCESSES", "4")
+    scheduler = LLMScheduler.from_env()
+    assert scheduler.get_stats()["rpm"] == 15
+    assert scheduler.tokens.nominal * 60 == pytest.approx(250)